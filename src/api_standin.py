@@ -0,0 +1,363 @@
+"""
+Local stand-in for the Comtrade API, for benchmarks and offline tests.
+
+    python3 src/main.py standin --port 8060 --latency 0.05 --rate 5 --records 2000
+
+Serves the endpoints the downloaders use:
+
+/data/v1/get/C/A/HS                 DataGetter._request_data
+/files/v1/app/reference/H2.json     MetaData._download_hscodes
+/countries.csv                      MetaData._get_country_data
+/standin/stats                      requests, throttled requests and bytes served
+
+Each response is replayed from a recording if one exists, and generated
+otherwise: trade data as random but repeatable records (the same query gives
+the same body), and the reference files from the json files in src/codes.
+
+With record_from set, requests without a recording are forwarded to that
+URL and the responses are saved as recordings for later runs.
+
+Latency, throttling and payload size are configurable: every response is
+delayed by latency (plus up to jitter) seconds; requests beyond rate per
+second get 429 with a Retry-After header; records is the number of
+generated records per commodity and period.
+"""
+
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from file_lock import atomic_open
+
+
+DATA_PATH = "/data/v1/get/C/A/HS"
+HSCODES_PATH = "/files/v1/app/reference/H2.json"
+COUNTRY_DATA_PATH = "/countries.csv"
+STATS_PATH = "/standin/stats"
+
+# Generated bodies kept in memory, so serving them does not dominate a load test
+_BODY_CACHE_SIZE = 64
+
+
+def _codes_dir() -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "codes")
+
+
+def _load_codes_json(name: str):
+    with open(os.path.join(_codes_dir(), f"{name}.json"), 'r') as _f:
+        return json.load(_f)
+
+
+def recording_name(path: str, query: dict[str, list[str]]) -> str:
+    """File name of the recording for a request"""
+    _params = sorted((k, v) for k, vs in query.items() for v in vs)
+    _key = path + ("?" + urlencode(_params) if _params else "")
+    _readable = re.sub(r"[^A-Za-z0-9=&.,-]+", "_", _key).strip("_")[:120]
+    return f"{_readable}.{hashlib.sha1(_key.encode()).hexdigest()[:10]}"
+
+
+class ComtradeStandIn:
+    def __init__(self,
+                 recordings_dir: str = None,
+                 record_from: str = None,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 rate: float = None,
+                 retry_after: int = 1,
+                 records: int = 2000,
+                 seed: int = 0):
+        """
+        Args:
+            recordings_dir: Directory of recorded responses to replay, and to save
+                new recordings in
+            record_from: Base URL of the real API; requests without a recording are
+                forwarded there and recorded. Needs recordings_dir
+            latency: Seconds every response is delayed by
+            jitter: Up to this many more seconds, chosen at random per response
+            rate: Requests per second accepted before answering 429; None for no limit
+            retry_after: Retry-After seconds sent with 429 responses
+            records: Generated records per commodity and period
+            seed: Seed for the generated trade data
+        """
+        if record_from is not None and recordings_dir is None:
+            raise ValueError("record_from needs a recordings_dir to save responses in.")
+
+        self.recordings_dir = recordings_dir
+        self.record_from = record_from.rstrip("/") if record_from else None
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.retry_after = retry_after
+        self.records = records
+        self.seed = seed
+
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._bodies: OrderedDict[str, bytes] = OrderedDict()
+
+        self._server = None
+        self._thread = None
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts serving in a background thread and returns the base URL"""
+        handler = type("Handler", (_StandInHandler,), {'standin': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    @property
+    def url(self) -> str:
+        _host, _port = self._server.server_address[:2]
+        return f"http://{_host}:{_port}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'throttled': self.throttled,
+            'bytes_sent': self.bytes_sent
+        }
+
+    def _admit(self) -> bool:
+        """Counts a request against the rate limit; False if it should be throttled"""
+        with self._lock:
+            self.requests += 1
+            if self.rate is None:
+                return True
+            _now = time.monotonic()
+            if _now - self._window_start >= 1.0:
+                self._window_start = _now
+                self._window_count = 0
+            if self._window_count >= self.rate:
+                self.throttled += 1
+                return False
+            self._window_count += 1
+            return True
+
+    def _sent(self, n: int):
+        with self._lock:
+            self.bytes_sent += n
+
+    def delay(self):
+        _seconds = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if _seconds > 0:
+            time.sleep(_seconds)
+
+    def response(self, path: str, query: dict[str, list[str]], api_key: str = None) -> tuple[int, str, bytes]:
+        """
+        Args:
+            path: Request path
+            query: Parsed query string
+            api_key: Subscription key sent with the request, only used to forward it
+        
+        Returns:
+            (status, content type, body) for a request
+        """
+        _recorded = self._replay(path, query)
+        if _recorded is not None:
+            return 200, self._content_type(path), _recorded
+
+        if self.record_from is not None:
+            return self._record(path, query, api_key)
+
+        _name = recording_name(path, query)
+        with self._lock:
+            if _name in self._bodies:
+                self._bodies.move_to_end(_name)
+                return 200, self._content_type(path), self._bodies[_name]
+
+        if path == DATA_PATH:
+            body = self.data_body(query)
+        elif path == HSCODES_PATH:
+            body = self.hscodes_body()
+        elif path == COUNTRY_DATA_PATH:
+            body = self.country_data_body()
+        else:
+            return 404, "text/plain", b"Not found\n"
+
+        with self._lock:
+            self._bodies[_name] = body
+            while len(self._bodies) > _BODY_CACHE_SIZE:
+                self._bodies.popitem(last=False)
+        return 200, self._content_type(path), body
+
+    @staticmethod
+    def _content_type(path: str) -> str:
+        return "text/csv" if path.endswith(".csv") else "application/json"
+
+    def _replay(self, path: str, query: dict[str, list[str]]) -> bytes | None:
+        if self.recordings_dir is None:
+            return None
+        _fp = os.path.join(self.recordings_dir, recording_name(path, query))
+        if not os.path.exists(_fp):
+            return None
+        with open(_fp, 'rb') as _f:
+            return _f.read()
+
+    def _record(self, path: str, query: dict[str, list[str]], api_key: str = None) -> tuple[int, str, bytes]:
+        import urllib3
+
+        _headers = {} if api_key is None else {'Ocp-Apim-Subscription-Key': api_key}
+        response = urllib3.request(
+            "GET", self.record_from + path, fields={k: vs[0] for k, vs in query.items()}, headers=_headers
+        )
+        if response.status == 200:
+            os.makedirs(self.recordings_dir, exist_ok=True)
+            _fp = os.path.join(self.recordings_dir, recording_name(path, query))
+            with atomic_open(_fp, 'wb') as _f:
+                _f.write(response.data)
+        return response.status, response.headers.get("Content-Type", "application/json"), response.data
+
+    def data_body(self, query: dict[str, list[str]]) -> bytes:
+        """A get/C/A/HS response with `records` generated records per commodity and period"""
+        _codes = query.get("cmdCode", [""])[0].split(",")
+        _periods = query.get("period", [""])[0].split(",")
+        _flow = query.get("flowCode", ["X"])[0]
+        _max = int(query.get("maxRecords", ["100000"])[0])
+        _countries = np.array(sorted(int(k) for k in _load_codes_json("m49_to_iso")), dtype=np.int64)
+
+        data = []
+        for _code in _codes:
+            for _period in _periods:
+                # Seeded by the cell, so a cell gets the same records whatever else is requested with it
+                _seed = int(hashlib.sha1(f"{self.seed}:{_code}:{_period}".encode()).hexdigest()[:8], 16)
+                _rng = np.random.default_rng(_seed)
+                _reporters = _rng.choice(_countries, self.records)
+                _partners = _rng.choice(_countries, self.records)
+                _values = np.round(_rng.lognormal(12, 2.5, self.records), 2)
+                _qty = np.round(_values / _rng.uniform(1, 20, self.records), 1)
+                for _r, _p, _v, _q in zip(_reporters.tolist(), _partners.tolist(), _values.tolist(), _qty.tolist()):
+                    data.append({
+                        'typeCode': 'C', 'freqCode': 'A', 'refPeriodId': int(f"{_period}0101"),
+                        'refYear': int(_period), 'refMonth': 52, 'period': _period,
+                        'reporterCode': _r, 'flowCode': _flow, 'partnerCode': _p, 'partner2Code': 0,
+                        'classificationCode': 'H6', 'cmdCode': _code, 'customsCode': 'C00', 'mosCode': '0',
+                        'motCode': 0, 'qtyUnitCode': 8, 'qty': _q, 'isQtyEstimated': False,
+                        'netWgt': _q, 'isNetWgtEstimated': False, 'cifvalue': None, 'fobvalue': _v,
+                        'primaryValue': _v, 'legacyEstimationFlag': 0, 'isReported': True, 'isAggregate': True
+                    })
+        data = data[:_max]
+        return json.dumps({'elapsedTime': "0.01 secs", 'count': len(data), 'data': data, 'error': ""}).encode()
+
+    @staticmethod
+    def hscodes_body() -> bytes:
+        """H2.json rebuilt from codes/hscodes.json"""
+        _records = [{k: v for k, v in r.items() if k != 'simple_text'} for r in _load_codes_json("hscodes")]
+        # The real file starts with an "all commodities" record, which MetaData drops
+        _records.insert(0, {'id': 'TOTAL', 'text': 'Total of all HS commodities', 'parent': '#'})
+        return json.dumps({'more': False, 'results': _records}).encode()
+
+    @staticmethod
+    def country_data_body() -> bytes:
+        """countries.csv rebuilt from codes/m49_to_iso.json and codes/iso_to_name.json"""
+        import csv
+        import io
+
+        _names = _load_codes_json("iso_to_name")
+        _out = io.StringIO()
+        _writer = csv.writer(_out)
+        _writer.writerow(['m49_comtrade', 'iso3', 'country'])
+        for _m49, _iso in _load_codes_json("m49_to_iso").items():
+            _writer.writerow([_m49, _iso, _names.get(_iso, _iso)])
+        return _out.getvalue().encode()
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real API
+    protocol_version = "HTTP/1.1"
+    standin: ComtradeStandIn = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        _url = urlsplit(self.path)
+        if _url.path == STATS_PATH:
+            self._send(200, "application/json", json.dumps(self.standin.stats()).encode(), count=False)
+            return
+
+        if not self.standin._admit():
+            self._send(429, "application/json", b'{"statusCode": 429, "message": "Rate limit is exceeded."}',
+                       headers={'Retry-After': str(self.standin.retry_after)})
+            return
+
+        self.standin.delay()
+        status, content_type, body = self.standin.response(
+            _url.path, parse_qs(_url.query), self.headers.get('Ocp-Apim-Subscription-Key')
+        )
+        self._send(status, content_type, body)
+
+    def _send(self, status: int, content_type: str, body: bytes, headers: dict = None, count: bool = True):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for _k, _v in (headers or {}).items():
+            self.send_header(_k, _v)
+        self.end_headers()
+        self.wfile.write(body)
+        if count:
+            self.standin._sent(len(body))
+
+
+def add_standin_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many more seconds per response")
+    parser.add_argument("--rate", type=float, default=None, help="Requests per second before answering 429")
+    parser.add_argument("--records", type=int, default=2000, help="Generated records per commodity and year")
+    parser.add_argument("--recordings", default=None, help="Directory of recorded responses")
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(prog="main.py standin", description="Serve a local stand-in for the Comtrade API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8060)
+    parser.add_argument("--record-from", default=None,
+                        help="Forward requests without a recording to this URL and record them, "
+                             "e.g. https://comtradeapi.un.org")
+    add_standin_arguments(parser)
+    args = parser.parse_args(argv)
+
+    standin = ComtradeStandIn(
+        recordings_dir=args.recordings,
+        record_from=args.record_from,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate=args.rate,
+        records=args.records
+    )
+    print(f"Comtrade stand-in serving on {standin.start(args.host, args.port)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Renders many commodity × year maps in parallel.
+
+Maps are built on a process pool. plotly.js is written once to the output
+directory and every page loads it from there, instead of each page inlining
+its own copy. A manifest.json with the time and size of every map is written
+at the end.
+
+    python3 src/main.py render-batch 2201-2209,wine 2015-2023 --workers 8
+"""
+
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from paths import plots_dir
+from file_lock import atomic_open
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def write_plotlyjs(directory: str) -> str:
+    """
+    Writes the installed plotly.js bundle to the directory, unless it is there already.
+
+    Returns:
+        str: The file name, which includes the plotly version.
+    """
+    import plotly
+    from plotly.offline import get_plotlyjs
+
+    _name = f"plotly-{plotly.__version__}.min.js"
+    _fp = os.path.join(directory, _name)
+    if not os.path.exists(_fp):
+        os.makedirs(directory, exist_ok=True)
+        with atomic_open(_fp, 'w', encoding='utf-8') as _f:
+            _f.write(get_plotlyjs())
+    return _name
+
+
+def _render_one(commodity: str, period: int, directory: str, plotlyjs: str, flow_mode: str,
+                compress: bool = False) -> dict:
+    """Builds and saves one map in a worker process"""
+    import io
+    import contextlib
+    from create_viz import ComtradeExportMap
+    from get_data import ComtradeData
+
+    item = {'commodity': commodity, 'period': period}
+    t0 = time.perf_counter()
+    try:
+        # The map classes print progress; keep the batch output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = ComtradeData(commodity_code=commodity, period=period)
+            t1 = time.perf_counter()
+            trade_map = ComtradeExportMap(data, flow_mode=flow_mode)
+            t2 = time.perf_counter()
+            _fp = trade_map.save_html(include_plotlyjs=plotlyjs, directory=directory, compress=compress)
+        t3 = time.perf_counter()
+    except Exception as e:
+        item.update(status='error', error=f"{type(e).__name__}: {e}", seconds=time.perf_counter() - t0)
+        return item
+
+    item.update(
+        status='ok',
+        file=os.path.basename(_fp),
+        bytes=os.path.getsize(_fp),
+        traces=len(trade_map.fig.data),
+        load_seconds=t1 - t0,
+        build_seconds=t2 - t1,
+        save_seconds=t3 - t2,
+        seconds=t3 - t0
+    )
+    return item
+
+
+def render_batch(commodity_codes: list[str],
+                 periods: list[int],
+                 directory: str = None,
+                 workers: int = None,
+                 flow_mode: str = "grouped",
+                 compress: bool = False) -> dict:
+    """
+    Renders a map for every commodity and period.
+
+    Args:
+        commodity_codes: Parsed HS commodity codes
+        periods: Years
+        directory: Output directory, defaults to plots_dir
+        workers: Number of processes, defaults to the number of CPUs
+        flow_mode: See create_viz.ComtradeExportMap
+        compress: Also write a .html.gz copy of every page
+
+    Returns:
+        dict: The manifest that is also written to manifest.json
+    """
+    directory = plots_dir if directory is None else directory
+    os.makedirs(directory, exist_ok=True)
+    plotlyjs = write_plotlyjs(directory)
+
+    jobs = [(c, p) for c in commodity_codes for p in periods]
+    items = []
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_render_one, c, p, directory, plotlyjs, flow_mode, compress)
+            for c, p in jobs
+        ]
+        for future in as_completed(futures):
+            item = future.result()
+            items.append(item)
+            if item['status'] == 'ok':
+                print(f"{item['commodity']} {item['period']}: {item['file']} "
+                      f"({item['bytes'] / 1e6:.1f} MB, {item['seconds']:.1f}s)")
+            else:
+                print(f"{item['commodity']} {item['period']}: {item['error']}")
+    elapsed = time.perf_counter() - t0
+
+    items.sort(key=lambda x: (x['commodity'], x['period']))
+    _ok = [i for i in items if i['status'] == 'ok']
+    manifest = {
+        'plotlyjs': plotlyjs,
+        'plotlyjs_bytes': os.path.getsize(os.path.join(directory, plotlyjs)),
+        'flow_mode': flow_mode,
+        'workers': workers or os.cpu_count(),
+        'elapsed_seconds': elapsed,
+        'rendered': len(_ok),
+        'failed': len(items) - len(_ok),
+        'total_bytes': sum(i['bytes'] for i in _ok),
+        'items': items
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), 'w', encoding='utf-8') as _f:
+        json.dump(manifest, _f, indent=2)
+
+    return manifest
+
+
+def main(argv: list[str] = None):
+    from prefetch import parse_commodities, parse_periods
+
+    parser = argparse.ArgumentParser(
+        prog="main.py render-batch",
+        description="Render maps for many commodities and years in parallel"
+    )
+    parser.add_argument("commodities", help="HS codes, names or ranges, e.g. 2201-2209,wine")
+    parser.add_argument("years", help="Years or ranges, e.g. 2015-2023")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: CPU count)")
+    parser.add_argument("--out-dir", default=None, help=f"Output directory (default: {plots_dir})")
+    parser.add_argument("--flow-mode", choices=("grouped", "pairs", "client"), default="grouped")
+    parser.add_argument("--gzip", action="store_true", help="Also write a precompressed .html.gz of every page")
+
+    args = parser.parse_args(argv)
+
+    manifest = render_batch(
+        parse_commodities(args.commodities),
+        parse_periods(args.years),
+        directory=args.out_dir,
+        workers=args.workers,
+        flow_mode=args.flow_mode,
+        compress=args.gzip
+    )
+    print(f"Rendered {manifest['rendered']} maps ({manifest['total_bytes'] / 1e6:.1f} MB) "
+          f"in {manifest['elapsed_seconds']:.1f}s, {manifest['failed']} failed")
+    return 1 if manifest['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
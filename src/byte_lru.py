@@ -0,0 +1,65 @@
+"""
+Least recently used cache bounded by the total size of its entries.
+
+Shared by get_data.ComtradeDataCache (loaded data) and map_server.RenderCache
+(rendered pages). Sizes come from a function of the entry and can be measured
+again when an entry grows after it was added. ByteLRU is not thread-safe;
+its users hold their own lock around it.
+"""
+
+
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class ByteLRU:
+    def __init__(self, max_bytes: int, size: Callable[[object], int]):
+        """
+        Args:
+            max_bytes: Total size above which the least recently used entries are dropped
+            size: Returns the size of an entry in bytes
+        """
+        self.max_bytes = max_bytes
+        self._size = size
+        self._entries: OrderedDict[Hashable, object] = OrderedDict()
+        self._sizes: dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def get(self, key: Hashable, default=None):
+        """The entry for the key, marked as most recently used, or default"""
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: Hashable, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._sizes[key] = self._size(value)
+        self.evict()
+
+    def remeasure(self, *keys: Hashable):
+        """Measures the given entries again, e.g. after they computed more data"""
+        for _key in keys:
+            if _key in self._entries:
+                self._sizes[_key] = self._size(self._entries[_key])
+        self.evict()
+
+    def evict(self):
+        # Always keep the most recently used entry, even if it is over budget on its own
+        while len(self._entries) > 1 and self.nbytes > self.max_bytes:
+            _key, _ = self._entries.popitem(last=False)
+            del self._sizes[_key]
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
@@ -0,0 +1,134 @@
+"""
+File formats for the cached, tidied Comtrade data.
+
+Each cache file holds one (commodity, period) table with the columns
+'exporter', 'partner', 'quantity' and 'value'. Reading a Feather or npz
+file gives categorical exporter/partner columns.
+
+JsonCache:      the original records JSON. Only kept for reading old caches.
+FeatherCache:   typed columnar Arrow file, country codes as categories. Needs pyarrow.
+NpzCache:       NumPy archive, country codes as int16 indices into a country list.
+
+default_cache() returns FeatherCache if pyarrow is available, otherwise NpzCache.
+"""
+
+
+import numpy as np
+import pandas as pd
+
+
+COLUMNS = ['quantity', 'value', 'exporter', 'partner']
+
+
+def _encode_countries(df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Encode the exporter and partner columns against one shared, sorted list of
+    country codes. Missing codes are encoded as -1.
+
+    Returns:
+        (countries, exporter_codes, partner_codes)
+    """
+    if isinstance(df['exporter'].dtype, pd.CategoricalDtype) and df['exporter'].dtype == df['partner'].dtype:
+        # Already coded against a shared country list
+        return (
+            np.asarray(df['exporter'].cat.categories, dtype=str),
+            df['exporter'].cat.codes.to_numpy().astype(np.int16),
+            df['partner'].cat.codes.to_numpy().astype(np.int16)
+        )
+    _both = pd.concat([df['exporter'], df['partner']], ignore_index=True)
+    _codes, countries = pd.factorize(_both, sort=True)
+    n = len(df)
+    return (
+        np.asarray(countries, dtype=str),
+        _codes[:n].astype(np.int16),
+        _codes[n:].astype(np.int16)
+    )
+
+
+class CacheFormat:
+    extension: str = ""
+
+    def write(self, df: pd.DataFrame, file_path: str):
+        raise NotImplementedError
+
+    def read(self, file_path: str) -> pd.DataFrame:
+        raise NotImplementedError
+
+
+class JsonCache(CacheFormat):
+    extension = ".json"
+
+    def write(self, df: pd.DataFrame, file_path: str):
+        df.to_json(file_path, orient='records', indent=2)
+
+    def read(self, file_path: str) -> pd.DataFrame:
+        return pd.read_json(file_path)[COLUMNS]
+
+
+class FeatherCache(CacheFormat):
+    extension = ".feather"
+
+    def write(self, df: pd.DataFrame, file_path: str):
+        countries, exporter, partner = _encode_countries(df)
+        pd.DataFrame({
+            'quantity': df['quantity'].astype('float64').to_numpy(),
+            'value': df['value'].astype('float64').to_numpy(),
+            'exporter': pd.Categorical.from_codes(exporter, categories=countries),
+            'partner': pd.Categorical.from_codes(partner, categories=countries),
+        }).to_feather(file_path)
+
+    def read(self, file_path: str) -> pd.DataFrame:
+        return pd.read_feather(file_path)[COLUMNS]
+
+
+class NpzCache(CacheFormat):
+    extension = ".npz"
+
+    def write(self, df: pd.DataFrame, file_path: str):
+        countries, exporter, partner = _encode_countries(df)
+        # np.savez appends ".npz" to paths without it, so write through a handle
+        with open(file_path, 'wb') as _f:
+            np.savez(
+                _f,
+                countries=countries,
+                exporter=exporter,
+                partner=partner,
+                quantity=df['quantity'].astype('float64').to_numpy(),
+                value=df['value'].astype('float64').to_numpy()
+            )
+
+    def read(self, file_path: str) -> pd.DataFrame:
+        with np.load(file_path) as _npz:
+            return pd.DataFrame({
+                'quantity': _npz['quantity'],
+                'value': _npz['value'],
+                'exporter': pd.Categorical.from_codes(_npz['exporter'], categories=_npz['countries']),
+                'partner': pd.Categorical.from_codes(_npz['partner'], categories=_npz['countries']),
+            })
+
+
+CACHE_FORMATS = {
+    "json": JsonCache,
+    "feather": FeatherCache,
+    "npz": NpzCache,
+}
+
+
+def default_cache() -> CacheFormat:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return NpzCache()
+    return FeatherCache()
+
+
+def get_cache_format(name: str | None = None) -> CacheFormat:
+    """
+    Args:
+        name: One of CACHE_FORMATS, or None for default_cache()
+    """
+    if name is None:
+        return default_cache()
+    if name not in CACHE_FORMATS:
+        raise ValueError(f"Invalid cache format: {name}. Expected one of {list(CACHE_FORMATS)}.")
+    return CACHE_FORMATS[name]()
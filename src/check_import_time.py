@@ -0,0 +1,97 @@
+"""
+Checks that importing the modules stays within a time budget and that the
+data-only modules do not pull in plotly.
+
+    python3 src/check_import_time.py [--scale 2.0]
+
+Each module is imported in a fresh interpreter with -X importtime. The exit
+status is 1 if any budget is exceeded.
+"""
+
+
+import os
+import sys
+import argparse
+import subprocess
+
+
+# Cumulative import time budgets in milliseconds. pandas dominates the data
+# modules, so their budget is mostly the cost of importing pandas.
+IMPORT_BUDGETS_MS = {
+    "paths": 50,
+    "codes.get_codes": 50,
+    "cache_formats": 1500,
+    "load_data": 1500,
+    "get_data": 1500,
+    "create_viz": 1500,
+}
+
+# Modules that must not import plotly
+DATA_ONLY_MODULES = ("paths", "codes.get_codes", "load_data", "get_data", "create_viz")
+
+# Wall time budget for the CLI help, in milliseconds
+CLI_HELP_BUDGET_MS = 500
+
+
+def src_dir() -> str:
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def import_time_ms(module: str) -> float:
+    """Cumulative import time of a module in a fresh interpreter, in milliseconds"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=src_dir(), capture_output=True, text=True, check=True
+    )
+    for line in reversed(result.stderr.splitlines()):
+        _fields = [f.strip() for f in line.split("|")]
+        if len(_fields) == 3 and _fields[2] == module:
+            return int(_fields[1]) / 1000
+    raise RuntimeError(f"No import time reported for {module}.")
+
+
+def imports_plotly(module: str) -> bool:
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, {module}; print('plotly' in sys.modules)"],
+        cwd=src_dir(), capture_output=True, text=True, check=True
+    )
+    return result.stdout.strip() == "True"
+
+
+def cli_help_ms() -> float:
+    import time
+    t0 = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "main.py", "--help"],
+        cwd=src_dir(), capture_output=True, check=True
+    )
+    return (time.perf_counter() - t0) * 1000
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check module import times against their budgets")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply all budgets, e.g. for slow machines")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        _ms = import_time_ms(module)
+        _ok = _ms <= budget * args.scale
+        failures += not _ok
+        print(f"{'ok  ' if _ok else 'FAIL'} {module:<20} {_ms:8.1f} ms (budget {budget * args.scale:.0f} ms)")
+
+    for module in DATA_ONLY_MODULES:
+        if imports_plotly(module):
+            failures += 1
+            print(f"FAIL {module:<20} imports plotly")
+
+    _ms = cli_help_ms()
+    _ok = _ms <= CLI_HELP_BUDGET_MS * args.scale
+    failures += not _ok
+    print(f"{'ok  ' if _ok else 'FAIL'} {'main.py --help':<20} {_ms:8.1f} ms (budget {CLI_HELP_BUDGET_MS * args.scale:.0f} ms)")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
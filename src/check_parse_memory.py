@@ -0,0 +1,179 @@
+"""
+Checks that parsing an API response stays within a peak memory budget, and
+that stream_parse.read_columns reads small bodies correctly.
+
+    python3 src/check_parse_memory.py [--records 100000] [--scale 2.0]
+
+Starts the API stand-in (api_standin.py) in a separate process, so that the
+response it builds is not counted, and requests one commodity and year of
+--records generated records through DataGetter._request_data, which parses the
+response as it streams in. The peak memory traced by tracemalloc during the
+request must stay under a fixed budget and a fraction of the response size,
+well below what json.loads of the whole body needs. Small bodies, fed one byte
+at a time, must give the RESPONSE_FIELDS dtypes, an empty table for no records
+and a ValueError for a cut-off or non-JSON body. The exit status is 1 if any
+check fails.
+
+Like check_import_time.py this is a script rather than a test: the project has
+no test suite, and the check needs its own process and a stand-in server.
+"""
+
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+from load_test import _server_stats
+
+
+# A 100k-record stand-in response is ~50 MB. Stream parsing it peaks at ~11 MB,
+# where reading the whole body into json.loads and a DataFrame peaks at ~230 MB
+DEFAULT_RECORDS = 100000
+PEAK_BUDGET_MB = 24
+# Peak as a share of the response size, which any parser holding the whole body would exceed
+PEAK_BUDGET_SHARE = 0.6
+
+STARTUP_TIMEOUT_SECONDS = 30
+
+
+def src_dir() -> str:
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def _free_port() -> int:
+    with socket.socket() as _s:
+        _s.bind(("127.0.0.1", 0))
+        return _s.getsockname()[1]
+
+
+def start_standin(records: int) -> tuple[subprocess.Popen, str]:
+    """Runs the stand-in in its own process and waits until it answers"""
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "api_standin.py", "--port", str(port), "--records", str(records)],
+        cwd=src_dir(), stdout=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    _deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while _server_stats(base_url) is None:
+        if process.poll() is not None or time.monotonic() > _deadline:
+            process.kill()
+            raise RuntimeError("The API stand-in did not start.")
+        time.sleep(0.1)
+    return process, base_url
+
+
+def parse_peak(base_url: str) -> tuple[int, int, int]:
+    """
+    Returns:
+        (peak traced bytes while requesting and parsing, response bytes, records parsed)
+    """
+    from http_client import HttpClient
+    from load_data import DataGetter
+    from codes.get_codes import codes
+
+    # Metadata is loaded once per process, not per response
+    _ = codes.m49_lookup
+    with tempfile.TemporaryDirectory(prefix="comtrade-parse-memory-") as _dir:
+        getter = DataGetter(_dir=_dir, api_key="check", http_client=HttpClient(base_url))
+        _before = _server_stats(base_url)['bytes_sent']
+
+        tracemalloc.start()
+        try:
+            df = getter._request_data(["2204"], [2021])
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        _bytes = _server_stats(base_url)['bytes_sent'] - _before
+        getter.http_client.close()
+    return peak, _bytes, len(df)
+
+
+def check_read_columns() -> list[str]:
+    """
+    Returns:
+        list[str]: A description of each failed case, empty if all passed
+    """
+    import numpy as np
+    from stream_parse import read_columns
+    from load_data import DataGetter
+
+    fields = DataGetter.RESPONSE_FIELDS
+    _dtypes = {'int': np.dtype('int64'), 'float': np.dtype('float64'), 'category': 'category'}
+
+    def _read(body: bytes):
+        # One byte per chunk, so every value is split across chunks
+        return read_columns((body[i:i + 1] for i in range(len(body))), fields)
+
+    failures = []
+    df = _read(b'{"elapsedTime": "0.1 secs", "count": 2, "data": ['
+               b'{"cmdCode": "2204", "period": "2021", "reporterCode": 251, "partnerCode": 276,'
+               b' "qty": 1.5e3, "primaryValue": 12345.67, "flowCode": "X"},'
+               b' {"cmdCode": "2204", "period": "2021", "reporterCode": 380, "qty": null,'
+               b' "primaryValue": 10}], "error": ""}')
+    for name, kind in fields.items():
+        if df[name].dtype != _dtypes[kind]:
+            failures.append(f"{name} is {df[name].dtype}, expected {kind}")
+    if df['partnerCode'].tolist() != [276, -1] or not np.isnan(df['qty'].iloc[1]) \
+            or df['primaryValue'].tolist() != [12345.67, 10.0] or df['cmdCode'].tolist() != ["2204", "2204"]:
+        failures.append(f"unexpected values: {df.to_dict('list')}")
+
+    df = _read(b'{"elapsedTime": "0.1 secs", "count": 0, "data": [], "error": ""}')
+    if len(df) != 0 or list(df.columns) != list(fields):
+        failures.append(f"empty body gave {len(df)} rows and columns {list(df.columns)}")
+
+    for body in (b'{"count": 2, "data": [{"cmdCode": "2204"}, {"cmdCo', b'Access denied', b''):
+        try:
+            _read(body)
+        except ValueError:
+            continue
+        failures.append(f"no ValueError for {body!r}")
+    return failures
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check the peak memory of parsing an API response against its budget")
+    parser.add_argument("--records", type=int, default=DEFAULT_RECORDS, help="Records in the response")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the budgets, e.g. for other Python versions")
+    args = parser.parse_args(argv)
+
+    process, base_url = start_standin(args.records)
+    try:
+        peak, response_bytes, records = parse_peak(base_url)
+    finally:
+        process.terminate()
+        process.wait()
+
+    failures = 0
+    _cases = check_read_columns()
+    failures += len(_cases)
+    for _case in _cases:
+        print(f"FAIL read_columns: {_case}")
+    if not _cases:
+        print(f"ok   {'read_columns':<20} dtypes, empty and error bodies")
+    if records != args.records:
+        failures += 1
+        print(f"FAIL parsed {records} records, expected {args.records}")
+
+    _budget = PEAK_BUDGET_MB * 2**20 * args.scale
+    _ok = peak <= _budget
+    failures += not _ok
+    print(f"{'ok  ' if _ok else 'FAIL'} {'peak memory':<20} {peak / 2**20:8.1f} MB (budget {_budget / 2**20:.0f} MB)")
+
+    _share = peak / response_bytes if response_bytes else 0.0
+    _ok = _share <= PEAK_BUDGET_SHARE * args.scale
+    failures += not _ok
+    print(f"{'ok  ' if _ok else 'FAIL'} {'peak / response':<20} {_share:8.2f}    "
+          f"(budget {PEAK_BUDGET_SHARE * args.scale:.2f}, response {response_bytes / 2**20:.1f} MB)")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
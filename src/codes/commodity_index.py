@@ -0,0 +1,215 @@
+"""
+Search index over the HS commodity codes and their descriptions.
+
+The index is built from hscodes.json in a single pass and saved next to it
+as a pickle, which is rebuilt whenever hscodes.json changes.
+
+index.hs_to_desc:   read-only mapping view, HS code -> description
+index.desc_to_hs:   read-only mapping view, description -> HS code
+index.prefix(q):    descriptions (or codes) starting with q
+index.tokens(q):    records containing every word of q
+index.search(q):    records ranked by how well they match q
+index.children(c):  codes one level below c in the HS hierarchy, e.g. "22" -> ["2201", ...]
+index.parent(c):    the code one level above c, or None for a chapter
+"""
+
+
+import os
+import re
+import bisect
+import pickle
+import difflib
+from collections.abc import Mapping
+
+
+INDEX_VERSION = 2
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class _IndexView(Mapping):
+    """Read-only mapping from keys to positions in a shared list of values"""
+    def __init__(self, positions: dict, values: list):
+        self._positions = positions
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._positions[key]]
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+
+class CommodityIndex:
+    def __init__(self, records: list[dict]):
+        """
+        Args:
+            records: The records of hscodes.json, with 'id', 'text', 'simple_text' and 'parent'
+        """
+        self.ids: list[str] = [r['id'] for r in records]
+        self.descs: list[str] = [r['simple_text'] for r in records]
+        
+        # HS hierarchy: chapters (2 digits) > headings (4) > subheadings (6)
+        self._parent: dict[str, str] = {}
+        self._children: dict[str, list[str]] = {}
+        for r in records:
+            if r.get('parent') in (None, "TOTAL", "#"):
+                continue
+            self._parent[r['id']] = r['parent']
+            self._children.setdefault(r['parent'], []).append(r['id'])
+
+        self._id_pos: dict[str, int] = {}
+        self._desc_pos: dict[str, int] = {}
+        self._tokens: dict[str, list[int]] = {}
+        for i, r in enumerate(records):
+            self._id_pos[r['id']] = i
+            # Later records win for duplicate descriptions, as before
+            self._desc_pos[r['simple_text']] = i
+            for _token in set(tokenize(r['simple_text']) + tokenize(r['text'])[1:]):
+                self._tokens.setdefault(_token, []).append(i)
+
+        # Sorted keys for binary-search prefix lookups
+        self._sorted_descs: list[tuple[str, int]] = sorted((d, i) for i, d in enumerate(self.descs))
+        self._sorted_ids: list[tuple[str, int]] = sorted((c, i) for i, c in enumerate(self.ids))
+        self._sorted_tokens: list[str] = sorted(self._tokens)
+
+    @classmethod
+    def load(cls, hscodes_file, index_path: str) -> "CommodityIndex":
+        """
+        Loads the pickled index, building and saving it first if it is
+        missing or older than the hscodes file.
+
+        Args:
+            hscodes_file: JsonFiles.File for hscodes.json
+            index_path: Path of the pickled index
+        """
+        _source = hscodes_file._file_path
+        _stamp = (INDEX_VERSION, os.path.getmtime(_source), os.path.getsize(_source))
+
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'rb') as _f:
+                    stamp, index = pickle.load(_f)
+                if stamp == _stamp:
+                    return index
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+                pass
+
+        index = cls(hscodes_file.load())
+        from file_lock import atomic_open
+        try:
+            with atomic_open(index_path, 'wb') as _f:
+                pickle.dump((_stamp, index), _f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            # A read-only install can still use the index it just built
+            pass
+        return index
+
+    @property
+    def hs_to_desc(self) -> Mapping:
+        return _IndexView(self._id_pos, self.descs)
+
+    @property
+    def desc_to_hs(self) -> Mapping:
+        return _IndexView(self._desc_pos, self.ids)
+
+    def children(self, code: str) -> list[str]:
+        return list(self._children.get(code, ()))
+    
+    def parent(self, code: str) -> str | None:
+        return self._parent.get(code)
+    
+    @staticmethod
+    def _prefix_range(sorted_keys: list, query: str) -> tuple[int, int]:
+        _lo = bisect.bisect_left(sorted_keys, (query,))
+        _hi = bisect.bisect_left(sorted_keys, (query + "￿",))
+        return _lo, _hi
+
+    def prefix(self, query: str, limit: int = 10) -> list[tuple[str, str]]:
+        """
+        (code, description) pairs whose description starts with the query,
+        or whose code does if the query is all digits.
+        """
+        query = query.strip().lower()
+        _sorted = self._sorted_ids if query.isdigit() else self._sorted_descs
+        _lo, _hi = self._prefix_range(_sorted, query)
+        return [(self.ids[i], self.descs[i]) for _, i in _sorted[_lo:min(_hi, _lo + limit)]]
+
+    def _token_matches(self, token: str) -> set[int]:
+        """Records with a word that starts with the token"""
+        _lo = bisect.bisect_left(self._sorted_tokens, token)
+        _hi = bisect.bisect_left(self._sorted_tokens, token + "￿")
+        matches = set()
+        for _t in self._sorted_tokens[_lo:_hi]:
+            matches.update(self._tokens[_t])
+        return matches
+
+    def tokens(self, query: str, limit: int = 10) -> list[tuple[str, str]]:
+        """(code, description) pairs containing a word starting with each word of the query"""
+        _tokens = tokenize(query)
+        if not _tokens:
+            return []
+        matches = set.intersection(*(self._token_matches(t) for t in _tokens))
+        return [(self.ids[i], self.descs[i]) for i in sorted(matches)[:limit]]
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[str, str, float]]:
+        """
+        Ranked fuzzy search. Exact and prefix matches come first, then records
+        sharing (possibly misspelt) words with the query.
+
+        Returns:
+            list[tuple[str, str, float]]: (code, description, score), best first.
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        scores: dict[int, float] = {}
+
+        def _score(i: int, s: float):
+            if s > scores.get(i, 0.0):
+                scores[i] = s
+
+        if query in self._id_pos:
+            _score(self._id_pos[query], 1.0)
+        if query in self._desc_pos:
+            _score(self._desc_pos[query], 1.0)
+
+        _sorted = self._sorted_ids if query.isdigit() else self._sorted_descs
+        _lo, _hi = self._prefix_range(_sorted, query)
+        for _key, i in _sorted[_lo:_hi]:
+            # Shorter completions rank higher
+            _score(i, 0.8 + 0.1 * len(query) / len(_key))
+
+        # Word matches, allowing for misspelt words: each word of the query
+        # counts fully where it starts a word of the record, and partly where
+        # it is spelt like one
+        _tokens = tokenize(query)
+        _coverage: dict[int, float] = {}
+        for _t in _tokens:
+            _weights: dict[int, float] = {}
+            for _close in difflib.get_close_matches(_t, self._sorted_tokens, n=3, cutoff=0.7):
+                _w = 0.9 * difflib.SequenceMatcher(None, _t, _close).ratio()
+                for i in self._tokens[_close]:
+                    _weights[i] = max(_weights.get(i, 0.0), _w)
+            for i in self._token_matches(_t):
+                _weights[i] = 1.0
+            for i, _w in _weights.items():
+                _coverage[i] = _coverage.get(i, 0.0) + _w / len(_tokens)
+        
+        for i, _c in _coverage.items():
+            _similarity = difflib.SequenceMatcher(None, query, self.descs[i]).ratio()
+            _score(i, 0.6 * _c + 0.3 * _similarity)
+
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], len(self.ids[x[0]]), self.ids[x[0]]))
+        return [(self.ids[i], self.descs[i], round(s, 3)) for i, s in ranked[:limit]]
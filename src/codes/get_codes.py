@@ -5,6 +5,11 @@ codes.m49_to_iso:   maps Comtrade m49 country codes to ISO-alpha3 code.
 codes.iso_to_name:  maps ISO-alpha3 to name. E.g. "FRA" -> "France"
 codes.hs_to_desc:   maps HS commodity codes to a description. E.g. "2204" -> "wine"
 codes.desc_to_hs:   maps the other way
+codes.country_dtype:    pandas CategoricalDtype of all ISO-alpha3 codes, shared by
+                        every exporter/partner column
+codes.m49_lookup:       array mapping m49 code -> category code in country_dtype
+codes.commodity_index:  search index over HS codes and descriptions,
+                        which hs_to_desc and desc_to_hs are views of
 """
 
 
@@ -12,8 +17,12 @@ import os
 import json
 import re
 import inspect
-import requests
-import pandas as pd
+
+from codes.commodity_index import CommodityIndex
+
+
+COUNTRY_DATA_URL = "https://raw.githubusercontent.com/DrPrettyman/CountryData/refs/heads/main/countries.csv"
+HSCODES_URL = "https://comtradeapi.un.org/files/v1/app/reference/H2.json"
 
 
 def dir_path() -> str:
@@ -37,9 +46,23 @@ class JsonFiles:
             return _data
         
         def write(self, data: list | dict):
-            with open(self._file_path, 'w') as _f:
+            # Written whole or not at all, so a concurrent load() never sees half a file
+            from file_lock import atomic_open
+            with atomic_open(self._file_path, 'w') as _f:
                 json.dump(data, _f)
         
+        def ensure(self, download):
+            """
+            Calls download() if the file does not exist. Only one process downloads;
+            the others wait for it and then find the file.
+            """
+            if self.exists():
+                return
+            from file_lock import FileLock
+            with FileLock(self._file_path):
+                if not self.exists():
+                    download()
+        
     def __init__(self, _dir: str):
         self._dir = _dir
         if not os.path.exists(self._dir):
@@ -52,7 +75,15 @@ class JsonFiles:
       
     
 class MetaData:
-    def __init__(self, _dir):
+    def __init__(self, _dir, country_data_url: str = COUNTRY_DATA_URL, hscodes_url: str = HSCODES_URL):
+        """
+        Args:
+            _dir: Directory for the json files
+            country_data_url: CSV of country codes and names
+            hscodes_url: Comtrade reference file of HS codes
+        """
+        self.country_data_url = country_data_url
+        self.hscodes_url = hscodes_url
         self.files = JsonFiles(_dir)
         self.files.add("m49_to_iso")
         self.files.add("iso_to_name")
@@ -62,13 +93,15 @@ class MetaData:
         
         self._m49_to_iso = None
         self._iso_to_name = None
-        self._hs_to_desc = None
-        self._desc_to_hs = None
+        self._country_dtype = None
+        self._m49_lookup = None
+        self._commodity_index = None
         
     def _get_country_data(self):
         if self._country_data is None:
+            import pandas as pd
             self._country_data = pd.read_csv(
-                'https://raw.githubusercontent.com/DrPrettyman/CountryData/refs/heads/main/countries.csv', 
+                self.country_data_url, 
                 keep_default_na=False
             )
         return self._country_data
@@ -90,7 +123,8 @@ class MetaData:
         self.files.iso_to_name.write(_d)
           
     def _download_hscodes(self):
-        response = requests.get("https://comtradeapi.un.org/files/v1/app/reference/H2.json")
+        import requests
+        response = requests.get(self.hscodes_url)
         response.raise_for_status()
         hscodes = json.loads(response.text)['results']
         hscodes.pop(0)
@@ -100,40 +134,24 @@ class MetaData:
         self.files.hscodes.write(hscodes)
   
     def _get_m49_to_iso(self) -> dict:
-        if not self.files.m49_to_iso.exists():
-            self._download_m49_to_iso()
+        self.files.m49_to_iso.ensure(self._download_m49_to_iso)
  
         iso_map = self.files.m49_to_iso.load()
             
         return {int(k): v for k, v in iso_map.items()}
     
     def _get_iso_to_name(self):
-        if not self.files.iso_to_name.exists():
-            self._download_iso_to_name()
+        self.files.iso_to_name.ensure(self._download_iso_to_name)
         
         return self.files.iso_to_name.load()
     
-    def _get_hs_to_desc(self):
-        if not self.files.hscodes.exists():
-            self._download_hscodes()
-            
-        _hscodes = self.files.hscodes.load()
-        
-        return {
-            _record['id']: _record['simple_text']
-            for _record in _hscodes
-        }
-        
-    def _get_desc_to_hs(self):
-        if not self.files.hscodes.exists():
-            self._download_hscodes()
-            
-        _hscodes = self.files.hscodes.load()
+    def _get_commodity_index(self) -> CommodityIndex:
+        self.files.hscodes.ensure(self._download_hscodes)
         
-        return {
-            _record['simple_text']: _record['id']
-            for _record in _hscodes
-        }
+        return CommodityIndex.load(
+            self.files.hscodes,
+            os.path.join(self.files._dir, "hscodes.index.pickle")
+        )
       
     @property
     def m49_to_iso(self):
@@ -141,23 +159,46 @@ class MetaData:
             self._m49_to_iso = self._get_m49_to_iso()
         return self._m49_to_iso
 
+    @property
+    def country_dtype(self):
+        if self._country_dtype is None:
+            import pandas as pd
+            self._country_dtype = pd.CategoricalDtype(
+                sorted(set(iso for iso in self.m49_to_iso.values() if iso))
+            )
+        return self._country_dtype
+    
+    @property
+    def m49_lookup(self):
+        if self._m49_lookup is None:
+            import numpy as np
+            _categories = self.country_dtype.categories
+            _lookup = np.full(max(self.m49_to_iso) + 1, -1, dtype=np.int16)
+            for m49, iso in self.m49_to_iso.items():
+                if iso:
+                    _lookup[m49] = _categories.get_loc(iso)
+            self._m49_lookup = _lookup
+        return self._m49_lookup
+
     @property
     def iso_to_name(self):
         if self._iso_to_name is None:
             self._iso_to_name = self._get_iso_to_name()
         return self._iso_to_name
 
+    @property
+    def commodity_index(self) -> CommodityIndex:
+        if self._commodity_index is None:
+            self._commodity_index = self._get_commodity_index()
+        return self._commodity_index
+
     @property
     def hs_to_desc(self):
-        if self._hs_to_desc is None:
-            self._hs_to_desc = self._get_hs_to_desc()
-        return self._hs_to_desc
+        return self.commodity_index.hs_to_desc
 
     @property
     def desc_to_hs(self):
-        if self._desc_to_hs is None:
-            self._desc_to_hs = self._get_desc_to_hs()
-        return self._desc_to_hs
+        return self.commodity_index.desc_to_hs
     
     
 codes = MetaData(_dir=dir_path())
\ No newline at end of file
@@ -2,14 +2,21 @@ import pandas as pd
 import numpy as np
 import os
 import inspect
-from millify import millify
-import plotly.graph_objects as go
 
-from get_data import ComtradeData
+from get_data import data_cache
+from flow_lod import FlowLod, others_label
 from codes.get_codes import codes
 from paths import plots_dir
 
-iso2name_map = codes.iso_to_name
+FLOW_MODES = ("grouped", "pairs", "client")
+FLOW_LINE_COLOR = 'rgba(255, 165, 0, 0.5)'  # Orange
+MIN_FLOW_WIDTH = 1
+MAX_FLOW_WIDTH = 5
+LINE_WIDTH_DECIMALS = 1  # Finer steps in line width are not visible
+PLOT_DIV_ID = "trade-map-div"
+# Version of the flow table built by _compute_flow_table(), which is persisted
+# with the data's other derived tables; bump it whenever that method changes
+FLOW_TABLE_VERSION = 1
 
 
 def dir_path():
@@ -20,8 +27,31 @@ def dir_path():
 
 
 class ComtradeExportMap:
-    def __init__(self, data):
+    def __init__(self, data, flow_mode: str = "grouped", width_buckets: int = 5, lod=None):
+        """
+        Args:
+            data: ComtradeData instance to visualize
+            flow_mode: "grouped" draws all of a country's flows as one trace per
+                line-width bucket; "pairs" draws one trace per bilateral flow;
+                "client" embeds the edge table in the saved page and builds the
+                clicked country's flow traces in the browser
+            width_buckets: Number of line widths used in "grouped" and "client" modes
+            lod: flow_lod.FlowLod policy, or a spec such as "top:10", that limits the
+                flows drawn for each country; the rest are summed up in the hover
+                text as "others". None draws every flow
+        """
+        import plotly.graph_objects as go
+        
+        if flow_mode not in FLOW_MODES:
+            raise ValueError(f"Invalid flow mode: {flow_mode}. Expected one of {FLOW_MODES}.")
+        if width_buckets < 1:
+            raise ValueError(f"width_buckets must be at least 1, got {width_buckets}.")
+        
         self.data = data
+        self.flow_mode = flow_mode
+        self.width_buckets = width_buckets
+        self.lod = FlowLod.parse(lod) if isinstance(lod, str) or lod is None else lod
+        self.flow_counts = {'drawn': 0, 'pruned': 0, 'value_drawn': 1.0}
         self.fig = go.Figure()
         self.export_traces = {}
         self.import_traces = {}
@@ -44,6 +74,8 @@ class ComtradeExportMap:
     
     @staticmethod
     def _create_colorbar(zmax: float) -> dict:
+        from millify import millify
+        
         _tick_vals = ComtradeExportMap._round_middle_values(np.linspace(0, zmax, 5))
         _tick_text = ["$"+millify(10**x, precision=0) for x in _tick_vals]
         _tick_text[0] = "$0"
@@ -61,14 +93,16 @@ class ComtradeExportMap:
         return colorbar
                 
     def _add_choropleths(self):
+        import plotly.graph_objects as go
+        
         export_country_names = [
-            iso2name_map.get(country, country) 
+            codes.iso_to_name.get(country, country) 
             for country in self.data.exports['country'].to_list()
         ]
         
         # Create country names for imports  
         import_country_names = [
-            iso2name_map.get(country, country) 
+            codes.iso_to_name.get(country, country) 
             for country in self.data.imports['country'].to_list()
         ]
         
@@ -83,12 +117,13 @@ class ComtradeExportMap:
                 text=export_country_names,
                 hovertemplate='<b>%{text}</b><br>' +
                             'Export Value: US$%{customdata[0]:,.0f}<br>' +
-                            'Top 5 Partners: %{customdata[1]}' +
+                            f'Top {self.data.top_k} Partners: %{{customdata[1]}}' +
                             '<br><i>Click to show export flows</i><extra></extra>',
                 customdata=list(
                     zip(
-                        self.data.exports['value'], 
-                        self.data.exports['top5_partners']
+                        # Shown as whole dollars
+                        self.data.exports['value'].round().astype('int64'),
+                        self.data.exports['top_partners']
                     )
                 ),
                 colorscale='Blues',
@@ -110,12 +145,13 @@ class ComtradeExportMap:
                 text=import_country_names,
                 hovertemplate='<b>%{text}</b><br>' +
                             'Import Value: US$%{customdata[0]:,.0f}<br>' +
-                            'Top 5 Partners: %{customdata[1]}' +
+                            f'Top {self.data.top_k} Partners: %{{customdata[1]}}' +
                             '<br><i>Click to show import flows</i><extra></extra>',
                 customdata=list(
                     zip(
-                        self.data.imports['value'], 
-                        self.data.imports['top5_partners']
+                        # Shown as whole dollars
+                        self.data.imports['value'].round().astype('int64'),
+                        self.data.imports['top_partners']
                         )
                     ),
                 colorscale='Greens',
@@ -132,132 +168,459 @@ class ComtradeExportMap:
         export_indices = {}
         import_indices = {}
         
-        # Create export flow traces
-        for country in self.data.all['exporter'].unique():
-            country_data = self.data.all[self.data.all['exporter'] == country].copy()
+        if self.flow_mode == "client":
+            # Flow traces are generated in the browser from the edge table
+            self.flow_trace_indices = {
+                "export": export_indices,
+                "import": import_indices
+            }
+            return
+        
+        flows = self._flow_table()
+        _drawn = 0
+        
+        # Create export flow traces, then import flow traces
+        for direction, country_col, trace_indices in (
+            ("export", 'exporter', export_indices), ("import", 'partner', import_indices)
+        ):
+            _flows = flows
+            if self.lod is not None:
+                _flows = flows[flows[f'{direction}_keep']]
+                _flows = _flows.assign(hover_text=_flows['hover_text'] + _flows[f'{direction}_others'])
             
-            if len(country_data) == 0:
-                continue
+            for country, country_flows in _flows.groupby(country_col, observed=True, sort=False):
+                indices = self._add_flow_traces(
+                    country_flows,
+                    width_col=f'{direction}_width',
+                    name=f"{direction}_flow_{country}"
+                )
                 
-            # Calculate normalized line widths
-            country_data['log_value'] = country_data['value'].apply(
-                lambda x: 0 if x < 1 else np.log10(x)
-            )
-            max_log = country_data['log_value'].max()
-            if max_log > 0:
-                country_data['normalized_width'] = 1 + (4 * country_data['log_value'] / max_log)
-            else:
-                country_data['normalized_width'] = 1
-            
-            indices = []
-            for _, row in country_data.iterrows():
-                _country_name = iso2name_map.get(country, country)
-                _partner_name = iso2name_map.get(row['partner'], row['partner'])
-                self.fig.add_trace(
-                    go.Scattergeo(
-                        locations=[country, row['partner']],
-                        locationmode='ISO-3',
-                        hovertemplate=f"<b>{_country_name} → {_partner_name}</b><br>" +
-                                    f"Value: US${row['value']:,.0f}<br>" +
-                                    f"Quantity: {row['quantity']:,.0f} litres<extra></extra>",
-                        mode='lines+markers',
-                        line=dict(
-                            width=row['normalized_width'],
-                            color='rgba(255, 165, 0, 0.5)'  # Orange
-                        ),
-                        marker=dict(size=3, color='red'),
-                        visible=False,
-                        showlegend=False,
-                        name=f"export_flow_{country}_{row['partner']}"
-                    )
+                if indices:
+                    trace_indices[country] = indices
+                _drawn += len(country_flows)
+        
+        self.flow_counts['drawn'] = _drawn
+        self.flow_trace_indices = {
+            "export": export_indices,
+            "import": import_indices
+        }
+        
+    def _flow_table(self) -> pd.DataFrame:
+        """
+        The edge table with line widths and hover labels for every flow, and the
+        level-of-detail columns if there is a policy.
+        
+        'export_width' is scaled relative to the exporter's largest flow and
+        'import_width' relative to the importer's largest flow.
+        """
+        # Widths and labels only depend on the data, so they are built once and
+        # persisted with the data's other derived tables
+        table = self.data.derived(
+            "flow_table",
+            lambda: {'table': self._compute_flow_table(self.data.flows)},
+            version=(FLOW_TABLE_VERSION, MIN_FLOW_WIDTH, MAX_FLOW_WIDTH, LINE_WIDTH_DECIMALS)
+        )['table']
+        
+        if self.lod is not None:
+            flows = self.data.flows
+            table = table.copy()
+            # Which flows each direction draws, and a line summing up the rest,
+            # shown on every drawn flow of the same country
+            for direction, country_col, keep, count, value in self._prune(flows):
+                _labels = np.array(
+                    [others_label(n, v, direction) for n, v in zip(count, value)] + [""], dtype=object
                 )
-                indices.append(len(self.fig.data) - 1)
-            
-            if indices:
-                export_indices[country] = indices
+                table[f'{direction}_keep'] = keep
+                table[f'{direction}_others'] = _labels[flows[country_col].cat.codes.to_numpy()]
+        return table
+    
+    @classmethod
+    def _compute_flow_table(cls, flows: pd.DataFrame) -> pd.DataFrame:
+        """Widths and hover labels for every flow, computed for all rows at once"""
+        exporter_names = cls._country_names(flows['exporter'])
+        partner_names = cls._country_names(flows['partner'])
         
-        # Create import flow traces
-        for country in self.data.all['partner'].unique():
-            country_data = self.data.all[self.data.all['partner'] == country].copy()
+        hover_text = (
+            "<b>" + exporter_names + " → " + partner_names + "</b><br>" +
+            "Value: US$" + flows['value'].map('{:,.0f}'.format) + "<br>" +
+            "Quantity: " + flows['quantity'].map('{:,.0f}'.format) + " litres"
+        )
+        
+        table = pd.DataFrame({
+            'exporter': flows['exporter'],
+            'partner': flows['partner'],
+            'export_width': (MIN_FLOW_WIDTH + (MAX_FLOW_WIDTH - MIN_FLOW_WIDTH) * flows['export_share']).round(LINE_WIDTH_DECIMALS),
+            'import_width': (MIN_FLOW_WIDTH + (MAX_FLOW_WIDTH - MIN_FLOW_WIDTH) * flows['import_share']).round(LINE_WIDTH_DECIMALS),
+            'hover_text': hover_text
+        })
+        return table
+    
+    def _prune(self, flows: pd.DataFrame) -> list[tuple]:
+        """
+        Applies self.lod to both directions of an edge table and updates self.flow_counts.
+        
+        Returns:
+            list[tuple]: (direction, country column, keep mask, others count, others value)
+                for exports and imports; the others arrays are indexed by country code
+        """
+        pruned = []
+        _value = np.nan_to_num(flows['value'].to_numpy(dtype=float))
+        _drawn = _total = 0
+        self.flow_counts = {'drawn': 0, 'pruned': 0, 'value_drawn': 1.0}
+        for direction, country_col in (("export", 'exporter'), ("import", 'partner')):
+            keep = self.lod.keep(flows, country_col)
+            count, value = self.lod.others(flows, keep, country_col)
+            pruned.append((direction, country_col, keep, count, value))
             
-            if len(country_data) == 0:
-                continue
+            _known = flows[country_col].cat.codes.to_numpy() >= 0
+            self.flow_counts['drawn'] += int(keep.sum())
+            self.flow_counts['pruned'] += int((_known & ~keep).sum())
+            _drawn += _value[keep].sum()
+            _total += _value[_known].sum()
+        self.flow_counts['value_drawn'] = float(_drawn / _total) if _total else 1.0
+        return pruned
+    
+    @staticmethod
+    def _country_names(countries: pd.Series) -> pd.Series:
+        """Country names for a categorical column of ISO3 codes, looked up once per category"""
+        _names = np.array(
+            [codes.iso_to_name.get(c, c) for c in countries.cat.categories] + ['n/a'],
+            dtype=object
+        )
+        # Missing values have code -1, which picks the trailing 'n/a'
+        return pd.Series(_names[countries.cat.codes.to_numpy()], index=countries.index)
+    
+    def _add_flow_traces(self, flows: pd.DataFrame, width_col: str, name: str) -> list[int]:
+        """
+        Add the flow traces for one country's flows and return their trace indices.
+        
+        Args:
+            flows: Rows of the flow table (see _flow_table) for one country
+            width_col: Column holding the line widths to use
+            name: Prefix for the trace names
+        """
+        if self.flow_mode == "pairs":
+            return self._add_pair_flow_traces(flows, width_col, name)
+        return self._add_grouped_flow_traces(flows, width_col, name)
+    
+    def _add_pair_flow_traces(self, flows: pd.DataFrame, width_col: str, name: str) -> list[int]:
+        """One trace per exporter→partner pair"""
+        import plotly.graph_objects as go
+        
+        indices = []
+        for exporter, partner, width, text in zip(
+            flows['exporter'], flows['partner'], flows[width_col], flows['hover_text']
+        ):
+            self.fig.add_trace(
+                go.Scattergeo(
+                    locations=[exporter, partner],
+                    locationmode='ISO-3',
+                    text=[text, text],
+                    # The same template for every trace, so the saved page stores it once
+                    hovertemplate="%{text}<extra></extra>",
+                    mode='lines+markers',
+                    line=dict(
+                        width=width,
+                        color=FLOW_LINE_COLOR
+                    ),
+                    marker=dict(size=3, color='red'),
+                    visible=False,
+                    showlegend=False,
+                    name=f"{name}_{exporter}_{partner}"
+                )
+            )
+            indices.append(len(self.fig.data) - 1)
+        return indices
+    
+    def _add_grouped_flow_traces(self, flows: pd.DataFrame, width_col: str, name: str) -> list[int]:
+        """
+        One trace per line-width bucket. Each flow is a segment of the trace,
+        separated from the next by None so plotly does not join them up.
+        """
+        import plotly.graph_objects as go
+        
+        n = self.width_buckets
+        _bucket = np.floor(
+            (flows[width_col].to_numpy() - MIN_FLOW_WIDTH) / (MAX_FLOW_WIDTH - MIN_FLOW_WIDTH) * n
+        ).clip(0, n - 1).astype(int)
+        
+        _exporters = flows['exporter'].to_numpy(dtype=object)
+        _partners = flows['partner'].to_numpy(dtype=object)
+        _text = flows['hover_text'].to_numpy(dtype=object)
+        _gap = np.full(len(flows), None, dtype=object)
+        
+        indices = []
+        for bucket in np.unique(_bucket):
+            _mask = _bucket == bucket
+            # Interleave as [exporter, partner, None, exporter, partner, None, ...]
+            locations = np.column_stack([_exporters[_mask], _partners[_mask], _gap[_mask]]).ravel()
+            hover_text = np.column_stack([_text[_mask], _text[_mask], _gap[_mask]]).ravel()
                 
-            # Calculate normalized line widths
-            country_data['log_value'] = country_data['value'].apply(
-                lambda x: 0 if x < 1 else np.log10(x)
+            self.fig.add_trace(
+                go.Scattergeo(
+                    locations=locations.tolist(),
+                    locationmode='ISO-3',
+                    text=hover_text.tolist(),
+                    hovertemplate="%{text}<extra></extra>",
+                    mode='lines+markers',
+                    line=dict(
+                        width=round(MIN_FLOW_WIDTH + (MAX_FLOW_WIDTH - MIN_FLOW_WIDTH) * (bucket + 0.5) / n, LINE_WIDTH_DECIMALS),
+                        color=FLOW_LINE_COLOR
+                    ),
+                    marker=dict(size=3, color='red'),
+                    visible=False,
+                    showlegend=False,
+                    name=f"{name}_w{bucket}"
+                )
             )
-            max_log = country_data['log_value'].max()
-            if max_log > 0:
-                country_data['normalized_width'] = 1 + (4 * country_data['log_value'] / max_log)
-            else:
-                country_data['normalized_width'] = 1
+            indices.append(len(self.fig.data) - 1)
+        return indices
+    
+    def _edge_table(self) -> dict:
+        """
+        Compact columnar form of the edge list for the client-side flow mode.
+        Countries are stored once and referenced by their index in 'countries'.
+        
+        With a level-of-detail policy only the edges drawn in at least one
+        direction are stored. 'keep' then flags the directions each edge is
+        drawn in (1 for exports, 2 for imports), and 'others' holds the
+        [count, value] of the flows left out per country index and direction.
+        """
+        # The flows table has every edge, and unlike the raw data it is persisted
+        _all = self.data.flows
+        # Both columns share the country categories, so their codes index one list
+        exporter = _all['exporter'].cat.codes.to_numpy()
+        partner = _all['partner'].cat.codes.to_numpy()
+        _known = (exporter >= 0) & (partner >= 0)
+        self.flow_counts['drawn'] = 2 * int(_known.sum())
+        
+        _extra = {}
+        if self.lod is not None:
+            _keep = np.zeros(len(_all), dtype=np.int8)
+            _extra['others'] = {}
+            for (direction, _, keep, count, value), bit in zip(self._prune(_all), (1, 2)):
+                _keep |= np.where(keep, bit, 0).astype(np.int8)
+                _extra['others'][direction] = {
+                    int(i): [int(count[i]), int(round(value[i]))] for i in np.flatnonzero(count)
+                }
+            _known &= _keep > 0
+            _extra['keep'] = _keep[_known].tolist()
+        
+        _all = _all[_known]
+        countries = _all['exporter'].cat.categories
+        return {
+            'countries': countries.tolist(),
+            'names': [codes.iso_to_name.get(c, c) for c in countries],
+            'exporter': exporter[_known].tolist(),
+            'partner': partner[_known].tolist(),
+            'value': self._whole_numbers(_all['value']),
+            'quantity': self._whole_numbers(_all['quantity']),
+            **_extra
+        }
+    
+    @staticmethod
+    def _whole_numbers(x: pd.Series) -> list:
+        """Rounded to whole numbers for the page, with missing values as None (null)"""
+        return [None if np.isnan(v) else int(round(v)) for v in x.to_numpy(dtype=float)]
+    
+    def _create_client_flow_handlers(self, div_id: str = PLOT_DIV_ID):
+        """Generate JavaScript code that builds flow traces on click from the embedded edge table"""
+        from html_writer import to_json
+        edge_table = to_json(self._edge_table())
+        
+        click_handler_js = f"""
+        <script>
+        document.addEventListener('DOMContentLoaded', function() {{
+            var gd = document.getElementById('{div_id}');
             
-            indices = []
-            for _, row in country_data.iterrows():
-                _country_name = iso2name_map.get(country, country)
-                _exporter_name = iso2name_map.get(row['exporter'], row['exporter'])
-                self.fig.add_trace(
-                    go.Scattergeo(
-                        locations=[row['exporter'], country],
-                        locationmode='ISO-3',
-                        hovertemplate=f"<b>{_exporter_name} → {_country_name}</b><br>" +
-                                    f"Value: US${row['value']:,.0f}<br>" +
-                                    f"Quantity: {row['quantity']:,.0f} litres<extra></extra>",
-                        mode='lines+markers',
-                        line=dict(
-                            width=row['normalized_width'],
-                            color='rgba(255, 165, 0, 0.5)'  # Orange
-                        ),
-                        marker=dict(size=3, color='red'),
-                        visible=False,
-                        showlegend=False,
-                        name=f"import_flow_{row['exporter']}_{country}"
-                    )
-                )
-                indices.append(len(self.fig.data) - 1)
+            // Edge table: countries are referenced by index
+            var edges = {edge_table};
+            var countryIndex = {{}};
+            edges.countries.forEach(function(c, i) {{ countryIndex[c] = i; }});
             
-            if indices:
-                import_indices[country] = indices
+            var widthBuckets = {self.width_buckets};
+            var minWidth = {MIN_FLOW_WIDTH};
+            var maxWidth = {MAX_FLOW_WIDTH};
+            
+            console.log('Trade map initialized');
+            
+            function formatNumber(x) {{
+                return x === null || x === undefined ? 'n/a' : x.toLocaleString('en-US', {{maximumFractionDigits: 0}});
+            }}
+            
+            // Build one trace per line-width bucket for a country's flows
+            function buildFlowTraces(country, direction) {{
+                var ci = countryIndex[country];
+                if (ci === undefined) {{
+                    return [];
+                }}
+                var own = direction === 'export' ? edges.exporter : edges.partner;
+                // Edges pruned for this direction by the level-of-detail policy are skipped
+                var bit = direction === 'export' ? 1 : 2;
+                var others = edges.others && edges.others[direction][ci];
+                var othersLabel = others ? '<br><i>+ ' + formatNumber(others[0]) + ' smaller ' +
+                    (direction === 'export' ? 'destinations' : 'origins') + ': US$' + formatNumber(others[1]) + '</i>' : '';
+                var rows = [];
+                var maxLog = 0;
+                for (var i = 0; i < own.length; i++) {{
+                    if (own[i] === ci && (!edges.keep || edges.keep[i] & bit)) {{
+                        // Missing (null) values are drawn at the smallest width
+                        var logValue = edges.value[i] === null || edges.value[i] < 1 ? 0 : Math.log10(edges.value[i]);
+                        rows.push([i, logValue]);
+                        if (logValue > maxLog) {{
+                            maxLog = logValue;
+                        }}
+                    }}
+                }}
+                
+                var buckets = {{}};
+                rows.forEach(function(r) {{
+                    var i = r[0];
+                    var width = maxLog > 0 ? minWidth + (maxWidth - minWidth) * r[1] / maxLog : minWidth;
+                    var b = Math.min(widthBuckets - 1, Math.floor((width - minWidth) / (maxWidth - minWidth) * widthBuckets));
+                    if (!buckets[b]) {{
+                        buckets[b] = {{locations: [], text: []}};
+                    }}
+                    var origin = edges.countries[edges.exporter[i]];
+                    var destination = edges.countries[edges.partner[i]];
+                    var label = '<b>' + edges.names[edges.exporter[i]] + ' → ' + edges.names[edges.partner[i]] + '</b><br>' +
+                                'Value: US$' + formatNumber(edges.value[i]) + '<br>' +
+                                'Quantity: ' + formatNumber(edges.quantity[i]) + ' litres' + othersLabel;
+                    buckets[b].locations.push(origin, destination, null);
+                    buckets[b].text.push(label, label, null);
+                }});
+                
+                return Object.keys(buckets).map(function(b) {{
+                    return {{
+                        type: 'scattergeo',
+                        locations: buckets[b].locations,
+                        locationmode: 'ISO-3',
+                        text: buckets[b].text,
+                        hovertemplate: '%{{text}}<extra></extra>',
+                        mode: 'lines+markers',
+                        line: {{
+                            width: minWidth + (maxWidth - minWidth) * (Number(b) + 0.5) / widthBuckets,
+                            color: '{FLOW_LINE_COLOR}'
+                        }},
+                        marker: {{size: 3, color: 'red'}},
+                        showlegend: false,
+                        name: direction + '_flow_' + country + '_w' + b
+                    }};
+                }});
+            }}
+            
+            // Remove all flow traces (everything except the first 2 choropleths)
+            function clearFlows() {{
+                var n = gd.data.length - 2;
+                if (n <= 0) {{
+                    return Promise.resolve();
+                }}
+                return Plotly.deleteTraces(gd, Array.from({{length: n}}, (_, i) => i + 2));
+            }}
+            
+            // Handle plotly clicks
+            gd.on('plotly_click', function(data) {{
+                var point = data.points[0];
+                var traceIndex = point.fullData.index;
+                
+                console.log('Clicked trace:', traceIndex, 'location:', point.location);
+                
+                clearFlows().then(function() {{
+                    var traces = [];
+                    if (traceIndex === 0) {{
+                        traces = buildFlowTraces(point.location, 'export');
+                    }} else if (traceIndex === 1) {{
+                        traces = buildFlowTraces(point.location, 'import');
+                    }}
+                    
+                    if (traces.length > 0) {{
+                        return Plotly.addTraces(gd, traces);
+                    }}
+                }}).catch(function(error) {{
+                    console.error('Error updating traces:', error);
+                }});
+            }});
+            
+            // Switching between the exports and imports views drops the current flows
+            gd.on('plotly_buttonclicked', function() {{
+                clearFlows().catch(function(error) {{
+                    console.error('Error updating traces:', error);
+                }});
+            }});
+        }});
+        </script>
+        """
         
-        self.flow_trace_indices = {
-            "export": export_indices,
-            "import": import_indices
-        }
+        return click_handler_js
     
-    def _create_click_handlers(self):
+    def _create_click_handlers(self, div_id: str = PLOT_DIV_ID):
         """Generate JavaScript code for handling map clicks"""
-        export_countries = self.data.exports['country'].tolist()
-        import_countries = self.data.imports['country'].tolist()
+        if self.flow_mode == "client":
+            return self._create_client_flow_handlers(div_id)
         
-        # Create mapping dictionaries for JavaScript
-        export_flow_map = {}
-        for country, indices in self.flow_trace_indices['export'].items():
-            if country in export_countries:
-                country_index = export_countries.index(country)
-                export_flow_map[country_index] = indices
+        from html_writer import to_json
         
-        import_flow_map = {}
-        for country, indices in self.flow_trace_indices['import'].items():
-            if country in import_countries:
-                country_index = import_countries.index(country)
-                import_flow_map[country_index] = indices
+        # Position of each country in its choropleth, which is the clicked pointIndex
+        export_positions = {c: i for i, c in enumerate(self.data.exports['country'].tolist())}
+        import_positions = {c: i for i, c in enumerate(self.data.imports['country'].tolist())}
         
-        total_traces = len(self.fig.data)
+        # Create mapping dictionaries for JavaScript
+        export_flow_map = {
+            export_positions[country]: indices
+            for country, indices in self.flow_trace_indices['export'].items()
+            if country in export_positions
+        }
+        import_flow_map = {
+            import_positions[country]: indices
+            for country, indices in self.flow_trace_indices['import'].items()
+            if country in import_positions
+        }
         
         # JavaScript code for click handling
         click_handler_js = f"""
         <script>
         document.addEventListener('DOMContentLoaded', function() {{
-            var gd = document.getElementById('{{plot_div}}');
+            var gd = document.getElementById('{div_id}');
             
             // Flow trace mappings
-            var exportFlowMap = {export_flow_map};
-            var importFlowMap = {import_flow_map};
-            var totalTraces = {total_traces};
+            var exportFlowMap = {to_json(export_flow_map)};
+            var importFlowMap = {to_json(import_flow_map)};
+            
+            // Flow traces that are currently visible
+            var visibleFlows = [];
             
             console.log('Trade map initialized');
             
+            // Show only the given flow traces, restyling just the ones that change
+            function showFlows(flowsToShow) {{
+                var show = {{}};
+                flowsToShow.forEach(function(i) {{ show[i] = true; }});
+                
+                var indices = [];
+                var visible = [];
+                visibleFlows.forEach(function(i) {{
+                    if (!show[i]) {{
+                        indices.push(i);
+                        visible.push(false);
+                    }}
+                }});
+                var wasVisible = {{}};
+                visibleFlows.forEach(function(i) {{ wasVisible[i] = true; }});
+                flowsToShow.forEach(function(i) {{
+                    if (!wasVisible[i]) {{
+                        indices.push(i);
+                        visible.push(true);
+                    }}
+                }});
+                
+                visibleFlows = flowsToShow;
+                if (indices.length === 0) {{
+                    return Promise.resolve();
+                }}
+                // One batched update for everything that is hidden or shown
+                return Plotly.update(gd, {{visible: visible}}, {{}}, indices);
+            }}
+            
             // Handle plotly clicks
             gd.on('plotly_click', function(data) {{
                 var point = data.points[0];
@@ -266,29 +629,24 @@ class ComtradeExportMap:
                 
                 console.log('Clicked trace:', traceIndex, 'point:', pointIndex);
                 
-                // Step 1: Hide all flow traces (everything except the first 2 choropleths)
-                var hidePromise = Plotly.restyle(gd, 'visible', false, Array.from({{length: totalTraces - 2}}, (_, i) => i + 2));
+                var flowsToShow = [];
+                if (traceIndex === 0 && exportFlowMap[pointIndex]) {{
+                    flowsToShow = exportFlowMap[pointIndex];
+                    console.log('Showing export flows:', flowsToShow);
+                }} else if (traceIndex === 1 && importFlowMap[pointIndex]) {{
+                    flowsToShow = importFlowMap[pointIndex];
+                    console.log('Showing import flows:', flowsToShow);
+                }}
                 
-                hidePromise.then(function() {{
-                    var flowsToShow = [];
-                    
-                    // Step 2: Determine which flows to show
-                    if (traceIndex === 0 && exportFlowMap[pointIndex]) {{
-                        flowsToShow = exportFlowMap[pointIndex];
-                        console.log('Showing export flows:', flowsToShow);
-                    }} else if (traceIndex === 1 && importFlowMap[pointIndex]) {{
-                        flowsToShow = importFlowMap[pointIndex];
-                        console.log('Showing import flows:', flowsToShow);
-                    }}
-                    
-                    // Step 3: Show only the selected flows
-                    if (flowsToShow.length > 0) {{
-                        return Plotly.restyle(gd, 'visible', true, flowsToShow);
-                    }}
-                }}).catch(function(error) {{
+                showFlows(flowsToShow).catch(function(error) {{
                     console.error('Error updating traces:', error);
                 }});
             }});
+            
+            // The exports/imports view buttons hide every flow trace
+            gd.on('plotly_buttonclicked', function() {{
+                visibleFlows = [];
+            }});
         }});
         </script>
         """
@@ -298,6 +656,9 @@ class ComtradeExportMap:
     def _setup_layout_and_controls(self):
         """Configure layout with dropdown menus and styling"""
         n_flow_traces = len(self.fig.data) - 2
+        # Restyle only the traces that exist now; in "client" mode flow traces
+        # added later in the browser are removed by the click script instead
+        flow_indices = list(range(2, 2 + n_flow_traces))
         
         self.fig.update_layout(
             title={
@@ -314,12 +675,12 @@ class ComtradeExportMap:
                     direction="left",
                     buttons=[
                         dict(
-                            args=[{"visible": [True, False] + [False] * n_flow_traces}],
+                            args=[{"visible": [True, False] + [False] * n_flow_traces}, [0, 1] + flow_indices],
                             label="Exports View",
                             method="restyle"
                         ),
                         dict(
-                            args=[{"visible": [False, True] + [False] * n_flow_traces}],
+                            args=[{"visible": [False, True] + [False] * n_flow_traces}, [0, 1] + flow_indices],
                             label="Imports View", 
                             method="restyle"
                         )
@@ -357,56 +718,65 @@ class ComtradeExportMap:
         _c = self.data._commodity.replace(" ", "-")
         return f"comtrade_{_c}_{self.data._period}.html"
     
-    def save_html(self, filename=None, include_plotlyjs=True):
+    def write_html(self, out, include_plotlyjs=True) -> dict:
+        """
+        Write the interactive map as a standalone HTML page
+        
+        Args:
+            out: Object with a write(str) method, e.g. an open file
+            include_plotlyjs: See save_html
+        
+        Returns:
+            dict: Number of traces and distinct trace styles written
+        """
+        from html_writer import write_figure_html
+        
+        # Generate the click handler JavaScript
+        click_js = self._create_click_handlers(PLOT_DIV_ID)
+        return write_figure_html(out, self.fig, PLOT_DIV_ID, include_plotlyjs, click_js)
+    
+    def save_html(self, filename=None, include_plotlyjs=True, directory=None, compress=False):
         """
         Save the interactive map as standalone HTML
         
+        The page is streamed to disk trace by trace (see html_writer), so it is
+        never held in memory as one string.
+        
         Args:
             filename: Output HTML filename
-            include_plotlyjs: Whether to include Plotly.js in the HTML file
+            include_plotlyjs: Whether to include Plotly.js in the HTML file,
+                or the path/URL of a plotly.js file for the page to load instead
+            directory: Output directory, defaults to plots_dir
+            compress: Also write a gzip-compressed copy next to the page
+                (filename + ".gz"), for static hosting
         """
+        import gzip
+        from html_writer import Tee
+        
         if filename is None:
             filename = self.create_file_name()
             
         if not filename.endswith(".html"):
-            filename += "html"
+            filename += ".html"
         
-        # Generate the click handler JavaScript
-        click_js = self._create_click_handlers()
-        
-        # Debug: Check for problematic characters
-        # Check if there are any null bytes or other control characters
-        control_chars = [c for c in click_js if ord(c) < 32 and c not in '\n\r\t']
-        print(f"Found {len(control_chars)} control characters")
-        if control_chars:
-            print("First few:", [hex(ord(c)) for c in control_chars[:5]])
-        
-        # Save the figure
-        html_string = self.fig.to_html(
-            include_plotlyjs=include_plotlyjs,
-            div_id="trade-map-div"
-        )
-        
-        # Insert the click handler JavaScript
-        html_string = html_string.replace(
-            'div_id="trade-map-div"',
-            'div_id="trade-map-div"'
-        ).replace(
-            '</body>',
-            click_js.replace('{plot_div}', 'trade-map-div') + '\n</body>'
-        )
-        
-        _fp = os.path.join(plots_dir, filename)
+        _dir = plots_dir if directory is None else directory
+        os.makedirs(_dir, exist_ok=True)
+        _fp = os.path.join(_dir, filename)
         with open(_fp, 'w', encoding='utf-8') as _f:
-            _f.write(html_string)
+            if compress:
+                with gzip.open(_fp + ".gz", 'wt', encoding='utf-8', compresslevel=9) as _gz:
+                    stats = self.write_html(Tee(_f, _gz), include_plotlyjs)
+            else:
+                stats = self.write_html(_f, include_plotlyjs)
         
-        print(f"Interactive trade map saved as '{filename}'")
-        print(f"Total traces: {len(self.fig.data)} (2 choropleths + {len(self.fig.data)-2} flow traces)")
+        print(f"Interactive trade map saved as '{filename}'" + (" (and .gz)" if compress else ""))
+        print(f"Total traces: {len(self.fig.data)} (2 choropleths + {len(self.fig.data)-2} flow traces), "
+              f"{stats['styles']} distinct trace styles")
         
         return _fp
 
 # Usage function
-def create_trade_visualization(commodity: str | int, period: int, filename=None):
+def create_trade_visualization(commodity: str | int, period: int, filename=None, flow_mode="grouped", lod=None):
     """
     Create a complete interactive trade visualization
     
@@ -414,18 +784,26 @@ def create_trade_visualization(commodity: str | int, period: int, filename=None)
         commodity: The HS Code (or name) of the commodity
         period: The year for which to display annual trade data
         output_file: Output HTML filename
+        flow_mode: How flow traces are built, see ComtradeExportMap
+        lod: Level-of-detail policy for the flows, e.g. "top:10", see flow_lod.FlowLod
     
     Returns:
         ComtradeExportMap instance
     """
     print("Creating trade visualization...")
     
-    # Import the data
-    data = ComtradeData(commodity_code=commodity, period=period)
-    print("Imported Comtrade data")
+    # Import the data, reusing it if it was loaded before in this process
+    _hits = data_cache.hits
+    data = data_cache.get(commodity, period)
+    if data_cache.hits > _hits:
+        print("Imported Comtrade data (already loaded in this process)")
+    elif data.source == "rollup":
+        print(f"Imported Comtrade data (rolled up from {len(data.source_codes)} cached sub-codes)")
+    else:
+        print(f"Imported Comtrade data ({data.source})")
     
     # Create the map
-    trade_map = ComtradeExportMap(data)
+    trade_map = ComtradeExportMap(data, flow_mode=flow_mode, lod=lod)
     
     # Save as HTML
     output_file = trade_map.save_html(filename=filename)
@@ -0,0 +1,124 @@
+"""
+Atomic file writes and cross-process file locks.
+
+atomic_path(path):  context manager giving a temporary path next to `path`,
+                    which replaces `path` in one rename when the block succeeds,
+                    so readers see either the old file or the complete new one.
+FileLock(path):     exclusive lock on `path`.lock, held across processes and threads.
+
+Together they make a cache single-flight: a worker that misses takes the
+key's lock, checks the cache again and only fetches if it is still missing.
+Workers that missed at the same time wait on the lock and then find the file.
+
+    with FileLock(cache_file):
+        if not os.path.exists(cache_file):
+            with atomic_path(cache_file) as _tmp:
+                fetch(_tmp)
+"""
+
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+LOCK_SUFFIX = ".lock"
+POLL_SECONDS = 0.05
+
+
+def temp_path(path: str) -> str:
+    """A temporary file name next to path, unique to this process and thread"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+@contextmanager
+def atomic_path(path: str):
+    """
+    Yields a temporary path to write to, then renames it to path.
+    If the block raises, the temporary file is removed and path is left as it was.
+    """
+    _tmp = temp_path(path)
+    try:
+        yield _tmp
+        os.replace(_tmp, path)
+    finally:
+        if os.path.exists(_tmp):
+            os.remove(_tmp)
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = 'w', **kwargs):
+    """Like open(path, mode), but the file only appears at path once it is closed"""
+    with atomic_path(path) as _tmp:
+        with open(_tmp, mode, **kwargs) as _f:
+            yield _f
+
+
+class FileLock:
+    def __init__(self, path: str, timeout: float = None):
+        """
+        Args:
+            path: The file to lock. The lock is taken on path + LOCK_SUFFIX,
+                which is created if it does not exist and left behind afterwards
+            timeout: Seconds to wait for the lock before raising TimeoutError,
+                None to wait as long as it takes
+        """
+        self.path = path + LOCK_SUFFIX
+        self.timeout = timeout
+        self._fd = None
+
+    def _try_lock(self, fd: int, blocking: bool) -> bool:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            if blocking and fcntl is not None:
+                raise
+            return False
+        return True
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        _fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # flock() can block in the kernel; msvcrt.locking() is polled
+            if self.timeout is None and fcntl is not None:
+                self._try_lock(_fd, blocking=True)
+            else:
+                _deadline = None if self.timeout is None else time.monotonic() + self.timeout
+                while not self._try_lock(_fd, blocking=False):
+                    if _deadline is not None and time.monotonic() > _deadline:
+                        raise TimeoutError(f"Timed out after {self.timeout}s waiting for {self.path}")
+                    time.sleep(POLL_SECONDS)
+        except BaseException:
+            os.close(_fd)
+            raise
+        self._fd = _fd
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
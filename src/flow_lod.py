@@ -0,0 +1,245 @@
+"""
+Level of detail for the flow lines of a trade map.
+
+Most bilateral flows are tiny next to a country's largest ones. A FlowLod
+policy keeps the flows worth drawing for each country and sums up the rest,
+which the map then shows as an "others" total in the hover text:
+
+    FlowLod("top", 10)          the 10 largest partners of each country
+    FlowLod("share", 0.95)      the largest partners that together make up 95%
+                                of the country's trade value
+    FlowLod("min", 1e6)         flows worth at least US$1,000,000
+
+Policies apply per country and direction: on the exports view a country keeps
+its largest destinations, on the imports view its largest origins.
+FlowLod.parse("top:10") reads a policy from the command line.
+
+    python3 src/main.py lod-report wine 2023 --flow-mode grouped
+
+builds the map once without pruning and once per policy, and reports the
+build time and page size each policy saves.
+"""
+
+
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+POLICIES = ("top", "share", "min")
+DEFAULT_REPORT_POLICIES = "top:20,top:10,top:5,share:0.95,share:0.8,min:100000"
+
+
+class FlowLod:
+    def __init__(self, policy: str, threshold: float):
+        """
+        Args:
+            policy: "top", "share" or "min"
+            threshold: Number of partners kept per country for "top", share of
+                each country's trade value kept for "share", in (0, 1], and
+                smallest value drawn for "min"
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid level-of-detail policy: {policy}. Expected one of {POLICIES}.")
+        if policy == "top" and (threshold < 1 or threshold != int(threshold)):
+            raise ValueError(f"'top' needs a whole number of partners of at least 1, got {threshold}.")
+        if policy == "share" and not 0 < threshold <= 1:
+            raise ValueError(f"'share' needs a share in (0, 1], got {threshold}.")
+        if policy == "min" and threshold < 0:
+            raise ValueError(f"'min' needs a value of at least 0, got {threshold}.")
+        self.policy = policy
+        self.threshold = int(threshold) if policy == "top" else float(threshold)
+
+    @classmethod
+    def parse(cls, spec: str | None):
+        """
+        Reads a policy written as "top:10", "share:0.95" or "min:1e6".
+        None, "" and "none" give None, which draws every flow.
+        """
+        if spec is None or spec.strip().lower() in ("", "none"):
+            return None
+        policy, _, threshold = spec.strip().lower().partition(":")
+        try:
+            return cls(policy, float(threshold))
+        except ValueError as e:
+            raise ValueError(f"Invalid level-of-detail spec '{spec}': {e}") from None
+
+    def __str__(self) -> str:
+        return f"{self.policy}:{self.threshold:g}"
+
+    def __repr__(self) -> str:
+        return f"FlowLod({self.policy!r}, {self.threshold!r})"
+
+    def keep(self, flows: pd.DataFrame, country_col: str) -> np.ndarray:
+        """
+        Which flows to draw for the countries in country_col.
+
+        Args:
+            flows: Edge table with categorical 'exporter' and 'partner' and 'value'
+            country_col: 'exporter' to prune each exporter's flows, 'partner' for importers
+
+        Returns:
+            np.ndarray: bool mask over the rows. Rows with an unknown country are never kept
+        """
+        _codes = flows[country_col].cat.codes.to_numpy()
+        _value = np.nan_to_num(flows['value'].to_numpy(dtype=float))
+        if self.policy == "min":
+            return (flows['value'].to_numpy(dtype=float) >= self.threshold) & (_codes >= 0)
+        keep = np.zeros(len(flows), dtype=bool)
+        if len(flows) == 0:
+            return keep
+
+        # Rank each country's flows by value, largest first
+        _order = np.lexsort((-_value, _codes))
+        _sorted_codes = _codes[_order]
+        _starts = np.flatnonzero(np.r_[True, _sorted_codes[1:] != _sorted_codes[:-1]])
+        _group = np.cumsum(np.r_[False, _sorted_codes[1:] != _sorted_codes[:-1]])
+        _rank = np.arange(len(_order)) - _starts[_group]
+
+        if self.policy == "top":
+            _keep = _rank < self.threshold
+        else:
+            _sorted_values = _value[_order]
+            _cumsum = np.cumsum(_sorted_values)
+            # Value of the country's larger flows, before this one
+            _before = _cumsum - _sorted_values - (_cumsum - _sorted_values)[_starts][_group]
+            _total = np.add.reduceat(_sorted_values, _starts)[_group]
+            # The largest flow is always kept, even if the country's total is 0
+            _keep = (_rank == 0) | (_before < self.threshold * _total)
+
+        keep[_order] = _keep
+        return keep & (_codes >= 0)
+
+    @staticmethod
+    def others(flows: pd.DataFrame, keep: np.ndarray, country_col: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Number and total value of the flows left out, per country.
+
+        Returns:
+            (count, value): arrays indexed by the category codes of country_col
+        """
+        _codes = flows[country_col].cat.codes.to_numpy()
+        _n = len(flows[country_col].cat.categories)
+        _pruned = ~keep & (_codes >= 0)
+        _value = np.nan_to_num(flows['value'].to_numpy(dtype=float))
+        count = np.bincount(_codes[_pruned], minlength=_n)
+        value = np.bincount(_codes[_pruned], weights=_value[_pruned], minlength=_n)
+        return count, value
+
+
+def others_label(count: int, value: float, direction: str) -> str:
+    """Hover text line for the flows a policy left out, '' if there are none"""
+    if count == 0:
+        return ""
+    _partners = "destinations" if direction == "export" else "origins"
+    return f"<br><i>+ {count:,} smaller {_partners}: US${value:,.0f}</i>"
+
+
+class _Counter:
+    """Writable that only counts the UTF-8 bytes written to it, and keeps them for gzip"""
+    def __init__(self):
+        self.parts = []
+        self.nbytes = 0
+
+    def write(self, s: str):
+        _b = s.encode('utf-8')
+        self.parts.append(_b)
+        self.nbytes += len(_b)
+
+
+def lod_report(commodity: str | int,
+               period: int,
+               policies: list,
+               flow_mode: str = "grouped") -> list[dict]:
+    """
+    Builds the map once without pruning and once per policy.
+
+    Args:
+        commodity: HS code or description
+        period: Year
+        policies: FlowLod instances (or specs such as "top:10")
+        flow_mode: See create_viz.ComtradeExportMap
+
+    Returns:
+        list[dict]: One row per policy, the first for no pruning, with the flows
+            drawn, the share of trade value drawn, the number of traces, the
+            build time and the page size (without plotly.js), raw and gzipped
+    """
+    import io
+    import gzip
+    import contextlib
+    from get_data import data_cache
+    from create_viz import ComtradeExportMap
+
+    data = data_cache.get(commodity, period)
+    # Aggregates are shared by every policy, so they are not part of the timings
+    _ = data.exports, data.imports, data.flows
+    # Nor are the first-use costs of plotly, paid by a small untimed build
+    with contextlib.redirect_stdout(io.StringIO()):
+        ComtradeExportMap(data, flow_mode=flow_mode, lod=FlowLod("top", 1)).write_html(_Counter(), False)
+
+    rows = []
+    for lod in [None] + [FlowLod.parse(p) if isinstance(p, str) else p for p in policies]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            trade_map = ComtradeExportMap(data, flow_mode=flow_mode, lod=lod)
+            _build = time.perf_counter() - t0
+            _out = _Counter()
+            trade_map.write_html(_out, include_plotlyjs=False)
+            _total = time.perf_counter() - t0
+        rows.append({
+            'policy': "none" if lod is None else str(lod),
+            'flows': trade_map.flow_counts['drawn'],
+            'pruned': trade_map.flow_counts['pruned'],
+            'value_drawn': trade_map.flow_counts['value_drawn'],
+            'traces': len(trade_map.fig.data),
+            'build_seconds': _build,
+            'total_seconds': _total,
+            'html_bytes': _out.nbytes,
+            'gzip_bytes': len(gzip.compress(b"".join(_out.parts), compresslevel=6)),
+        })
+    return rows
+
+
+def print_report(rows: list[dict]):
+    _base = rows[0]
+
+    def _saving(row, key):
+        return 1 - row[key] / _base[key] if _base[key] else 0.0
+
+    print(f"{'policy':<12} {'flows':>8} {'value':>7} {'traces':>7} {'build ms':>9} {'total ms':>9} "
+          f"{'html KB':>9} {'gzip KB':>8}   saved: build  html")
+    for row in rows:
+        print(f"{row['policy']:<12} {row['flows']:>8,} {row['value_drawn']:>7.1%} {row['traces']:>7,} "
+              f"{row['build_seconds'] * 1000:>9.0f} {row['total_seconds'] * 1000:>9.0f} "
+              f"{row['html_bytes'] / 1e3:>9,.0f} {row['gzip_bytes'] / 1e3:>8,.0f}   "
+              f"{_saving(row, 'total_seconds'):>11.0%} {_saving(row, 'html_bytes'):>5.0%}")
+
+
+def main(argv: list[str] = None):
+    from create_viz import FLOW_MODES
+
+    parser = argparse.ArgumentParser(
+        prog="main.py lod-report",
+        description="Report the build time and page size saved by each flow level-of-detail policy"
+    )
+    parser.add_argument("commodity", help="Commodity name or HS code")
+    parser.add_argument("year", type=int, help="Year")
+    parser.add_argument("--flow-mode", choices=FLOW_MODES, default="grouped")
+    parser.add_argument("--policies", default=DEFAULT_REPORT_POLICIES,
+                        help=f"Comma separated policies (default: {DEFAULT_REPORT_POLICIES})")
+    args = parser.parse_args(argv)
+
+    try:
+        policies = [FlowLod.parse(p) for p in args.policies.split(",")]
+    except ValueError as e:
+        parser.error(str(e))
+    print_report(lod_report(args.commodity, args.year, [p for p in policies if p is not None], args.flow_mode))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+Consolidated SQLite store of every cached (commodity, period) table.
+
+The file cache keeps one file per commodity and period, so a question that
+spans commodities, like "everything France exported in 2021", has to open
+every file. The store keeps all flows in one indexed table instead:
+
+    flows(cmd_code, period, exporter, partner, quantity, value)
+    cells(cmd_code, period, n_flows)        which tables are stored
+
+flows is indexed on (cmd_code, period, exporter, partner), and on
+(exporter, period) and (partner, period) for slices across commodities.
+
+DataGetter(store=...) writes every table it caches through to the store,
+and DataGetter.backfill_store() adds the tables cached before that.
+
+    store = FlowStore(flow_store_path)
+    store.query(exporters="FRA", periods=2021)
+"""
+
+
+import os
+import sqlite3
+import threading
+from typing import Iterable
+
+import pandas as pd
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS flows (
+    cmd_code TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    exporter TEXT,
+    partner TEXT,
+    quantity REAL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS flows_cell ON flows (cmd_code, period, exporter, partner);
+CREATE INDEX IF NOT EXISTS flows_exporter ON flows (exporter, period);
+CREATE INDEX IF NOT EXISTS flows_partner ON flows (partner, period);
+CREATE TABLE IF NOT EXISTS cells (
+    cmd_code TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    n_flows INTEGER NOT NULL,
+    PRIMARY KEY (cmd_code, period)
+);
+"""
+
+COLUMNS = ['cmd_code', 'period', 'exporter', 'partner', 'quantity', 'value']
+
+
+def _where(filters: dict, min_value: float = None) -> tuple[str, list]:
+    """
+    WHERE clause and parameters for column -> value(s) filters; None values are skipped
+    """
+    _clauses = []
+    _params = []
+    for _column, _values in filters.items():
+        if _values is None:
+            continue
+        _values = [_values] if isinstance(_values, (str, int)) else list(_values)
+        _clauses.append(f"{_column} IN ({', '.join('?' * len(_values))})")
+        _params.extend(int(v) if _column == 'period' else str(v) for v in _values)
+    if min_value is not None:
+        _clauses.append("value >= ?")
+        _params.append(float(min_value))
+    return (" WHERE " + " AND ".join(_clauses) if _clauses else ""), _params
+
+
+class FlowStore:
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite database file, created if it does not exist
+        """
+        self.path = path
+        self._local = threading.local()
+        _dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(_dir, exist_ok=True)
+        with self._connection() as _con:
+            _con.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads, so each thread opens its own
+        _con = getattr(self._local, "connection", None)
+        if _con is None:
+            _con = sqlite3.connect(self.path, timeout=30.0)
+            # Readers are not blocked while a table is written
+            _con.execute("PRAGMA journal_mode=WAL")
+            _con.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = _con
+        return _con
+
+    def close(self):
+        _con = getattr(self._local, "connection", None)
+        if _con is not None:
+            _con.close()
+            self._local.connection = None
+
+    def write(self, commodity_code: str, period: int, df: pd.DataFrame):
+        """
+        Stores the table of one commodity and period, replacing it if it is
+        already stored.
+
+        Args:
+            commodity_code: Parsed HS code
+            period: Year
+            df: Tidied table with 'exporter', 'partner', 'quantity' and 'value'
+        """
+        _df = df[['exporter', 'partner', 'quantity', 'value']].astype(object)
+        # Missing countries and quantities are stored as NULL
+        _rows = _df.where(_df.notna(), None).itertuples(index=False, name=None)
+        _con = self._connection()
+        with _con:
+            _con.execute("DELETE FROM flows WHERE cmd_code = ? AND period = ?", (commodity_code, int(period)))
+            _con.executemany(
+                "INSERT INTO flows VALUES (?, ?, ?, ?, ?, ?)",
+                ((commodity_code, int(period), *_row) for _row in _rows)
+            )
+            _con.execute(
+                "INSERT OR REPLACE INTO cells VALUES (?, ?, ?)",
+                (commodity_code, int(period), len(df))
+            )
+
+    def has(self, commodity_code: str, period: int) -> bool:
+        _cur = self._connection().execute(
+            "SELECT 1 FROM cells WHERE cmd_code = ? AND period = ?", (commodity_code, int(period))
+        )
+        return _cur.fetchone() is not None
+
+    def cells(self) -> pd.DataFrame:
+        """The stored (cmd_code, period) tables and their number of flows"""
+        return pd.read_sql_query(
+            "SELECT cmd_code, period, n_flows FROM cells ORDER BY cmd_code, period", self._connection()
+        )
+
+    def query(self,
+              commodity_codes: str | Iterable[str] = None,
+              periods: int | Iterable[int] = None,
+              exporters: str | Iterable[str] = None,
+              partners: str | Iterable[str] = None,
+              min_value: float = None) -> pd.DataFrame:
+        """
+        Flows matching every given filter; a filter left as None matches everything.
+
+        Args:
+            commodity_codes: Parsed HS code(s)
+            periods: Year(s)
+            exporters: ISO3 code(s) of exporters
+            partners: ISO3 code(s) of partners
+            min_value: Only flows worth at least this much
+
+        Returns:
+            pd.DataFrame: COLUMNS, with exporter and partner as categories of
+                codes.country_dtype.
+        """
+        _clause, _params = _where(
+            {'cmd_code': commodity_codes, 'period': periods, 'exporter': exporters, 'partner': partners},
+            min_value
+        )
+        df = pd.read_sql_query(f"SELECT {', '.join(COLUMNS)} FROM flows{_clause}", self._connection(), params=_params)
+        return self._country_categories(df)
+
+    def totals(self,
+               by: str = "exporter",
+               commodity_codes: str | Iterable[str] = None,
+               periods: int | Iterable[int] = None) -> pd.DataFrame:
+        """
+        Total value and quantity per exporter or partner, summed in SQLite.
+
+        Args:
+            by: "exporter" or "partner"
+            commodity_codes: Parsed HS code(s), None for all
+            periods: Year(s), None for all
+        """
+        if by not in ("exporter", "partner"):
+            raise ValueError(f"Invalid grouping: {by}. Expected 'exporter' or 'partner'.")
+        _clause, _params = _where({'cmd_code': commodity_codes, 'period': periods})
+        df = pd.read_sql_query(
+            f"SELECT {by}, SUM(value) AS value, SUM(quantity) AS quantity FROM flows{_clause} "
+            f"GROUP BY {by} ORDER BY value DESC",
+            self._connection(), params=_params
+        )
+        return self._country_categories(df)
+
+    @staticmethod
+    def _country_categories(df: pd.DataFrame) -> pd.DataFrame:
+        from codes.get_codes import codes
+        for col in ('exporter', 'partner'):
+            if col in df:
+                df[col] = df[col].astype(codes.country_dtype)
+        return df
+
+
+def main(argv: list[str] = None):
+    import time
+    import argparse
+    from paths import comtrade_data_path, flow_store_path
+    from prefetch import parse_commodities, parse_periods
+
+    parser = argparse.ArgumentParser(prog="main.py query", description="Query the consolidated store of cached flows")
+    parser.add_argument("--commodity", default=None, help="HS codes, names or ranges, e.g. 2201-2209,wine")
+    parser.add_argument("--year", default=None, help="Years or ranges, e.g. 2015-2023")
+    parser.add_argument("--exporter", default=None, help="ISO3 codes, comma separated, e.g. FRA,ITA")
+    parser.add_argument("--partner", default=None, help="ISO3 codes, comma separated")
+    parser.add_argument("--min-value", type=float, default=None, help="Only flows worth at least this much")
+    parser.add_argument("--totals", choices=("exporter", "partner"), default=None,
+                        help="Print totals per exporter or partner instead of flows")
+    parser.add_argument("--backfill", action="store_true", help="First add cached tables missing from the store")
+    parser.add_argument("--store", default=flow_store_path, help=f"Database file (default: {flow_store_path})")
+    parser.add_argument("-n", type=int, default=20, help="Number of rows to print")
+    args = parser.parse_args(argv)
+
+    store = FlowStore(args.store)
+    if args.backfill:
+        from load_data import DataGetter
+        _written = DataGetter(_dir=comtrade_data_path, store=store).backfill_store()
+        print(f"Added {_written} cached tables to the store")
+
+    _codes = parse_commodities(args.commodity) if args.commodity else None
+    _periods = parse_periods(args.year) if args.year else None
+    t0 = time.perf_counter()
+    if args.totals:
+        df = store.totals(args.totals, _codes, _periods)
+    else:
+        df = store.query(
+            _codes, _periods,
+            args.exporter.split(",") if args.exporter else None,
+            args.partner.split(",") if args.partner else None,
+            args.min_value
+        ).sort_values('value', ascending=False)
+    _ms = (time.perf_counter() - t0) * 1000
+
+    print(df.head(args.n).to_string(index=False))
+    print(f"{len(df)} rows in {_ms:.1f} ms")
+    return 0
@@ -1,34 +1,74 @@
 import os
 import sys
 import inspect
-import json
 import pandas as pd
 import numpy as np
-import re
+import pickle
+import threading
+from typing import Callable
 
-from paths import comtrade_data_path, get_api_key
+from paths import comtrade_data_path
 from load_data import DataGetter
+from trade_matrix import TradeMatrix
+from file_lock import atomic_open
+from byte_lru import ByteLRU
 
 
 
+# The API key is read when the first download is made
 data_getter = DataGetter(
-    _dir=comtrade_data_path,
-    api_key=get_api_key()
+    _dir=comtrade_data_path
 )
 
+# Version of what set_aggregates() and set_flows() compute. Tables persisted by
+# an older version are recomputed; bump it whenever either method changes.
+AGGREGATES_VERSION = 1
+
     
 class ComtradeData:
     def __init__(self, 
                  commodity_code: int | str,
-                 period: int):
-        
+                 period: int,
+                 top_k: int = 5,
+                 rollup: bool = True,
+                 matrix: str | None = None,
+                 persist: bool = True):
+        """
+        Args:
+            commodity_code: HS code or description of the commodity
+            period: Year
+            top_k: Number of top partners listed per country in exports/imports
+            rollup: Build an uncached chapter or heading from its cached sub-codes
+                when all of them are cached, instead of downloading it.
+                self.source records whether the data came from the "cache",
+                a "rollup" or a "download", and self.source_codes the codes read
+            matrix: "dense" or "csr" to compute exports, imports and flows from a
+                country × country TradeMatrix instead of the edge table. None
+                keeps the edge table; self.matrix is then built on first use
+            persist: Save the exports, imports and flows tables next to the cached
+                data once computed, and read them from there instead of computing
+                them again. They are recomputed when the cached data changes, or
+                when AGGREGATES_VERSION does. Cached data is then only read
+                once something needs more than the persisted tables
+        """
         self._period: int = period
+        self.top_k: int = top_k
         self._code: str = DataGetter.parse_commodity_code(commodity_code)
         self._commodity: str = DataGetter.commodity_code_desc(commodity_code)
         
-        self._data: pd.DataFrame = data_getter.load(commodity_code, period)
+        self.source, self.source_codes = data_getter.find_source(self._code, period, rollup=rollup)
+        self._data = None
+        if self.source == "download":
+            # Downloads happen here, so that a failed one fails the constructor
+            self._data = data_getter.load_from(self.source, self.source_codes, period)
+        self._matrix_layout = matrix
+        self._persist = persist
+        self._derived_stamp = None
+        self._derived = {}
+        self._matrix = None
         self._exports = None
         self._imports = None
+        self._flows = None
         
     @property
     def period(self) -> int:
@@ -40,41 +80,200 @@ class ComtradeData:
     
     @property
     def all(self) -> pd.DataFrame:
+        if self._data is None:
+            self._data = data_getter.load_from(self.source, self.source_codes, self._period)
         return self._data
     
+    @property
+    def matrix(self) -> TradeMatrix:
+        if self._matrix is None:
+            self._matrix = TradeMatrix(self.all, layout=self._matrix_layout or "dense")
+        return self._matrix
+    
+    def bilateral(self, exporter: str, partner: str) -> tuple[float, float]:
+        """(value, quantity) of the flow between two ISO3 codes, (0, 0) if there is none"""
+        return self.matrix.get(exporter, partner)
+    
+    def _stamp(self) -> tuple | None:
+        """What persisted tables must have been computed from to be used, None if unknown"""
+        if self._derived_stamp is None:
+            _files = data_getter.content_stamp(self.source_codes, self._period)
+            self._derived_stamp = () if _files is None else (AGGREGATES_VERSION, _files, self._matrix_layout)
+        return self._derived_stamp or None
+    
+    def _derived_file(self, name: str) -> str:
+        # Each matrix layout keeps its own tables, so alternating layouts do not overwrite each other
+        _layout = "" if self._matrix_layout is None else f".{self._matrix_layout}"
+        return data_getter.derived_file(self._code, self._period, name + _layout)
+    
+    def _load_derived(self, name: str, version) -> dict | None:
+        """Tables persisted by _save_derived, or None if there are none for the current data"""
+        if not self._persist or self._stamp() is None:
+            return None
+        try:
+            with open(self._derived_file(name), 'rb') as _f:
+                stamp, tables = pickle.load(_f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+            return None
+        return tables if stamp == (self._stamp(), version) else None
+    
+    def _save_derived(self, name: str, tables: dict, version):
+        if not self._persist or self._stamp() is None:
+            return
+        _fp = self._derived_file(name)
+        try:
+            os.makedirs(os.path.dirname(_fp), exist_ok=True)
+            with atomic_open(_fp, 'wb') as _f:
+                pickle.dump(((self._stamp(), version), tables), _f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            # A read-only cache can still use the tables just computed
+            pass
+    
+    def derived(self, name: str, compute: Callable[[], dict], version=None) -> dict:
+        """
+        Tables computed from this data by compute(), kept in memory and persisted
+        like the exports, imports and flows tables. They are computed again when
+        the cached data, AGGREGATES_VERSION or version changes.
+        
+        Args:
+            name: File name of the tables, unique per kind of table
+            compute: Returns a dict of DataFrames (or other picklable values)
+            version: Version of compute(), to bump whenever what it computes changes
+        """
+        if name not in self._derived:
+            tables = self._load_derived(name, version)
+            if tables is None:
+                tables = compute()
+                self._save_derived(name, tables, version)
+            self._derived[name] = tables
+        return self._derived[name]
+    
+    @staticmethod
+    def _aggregate_side(own: np.ndarray,
+                        other: np.ndarray,
+                        values: np.ndarray,
+                        quantities: np.ndarray,
+                        dtype: pd.CategoricalDtype,
+                        top_k: int) -> pd.DataFrame:
+        """
+        Totals and top partners per country for one side of the trade.
+        
+        Args:
+            own: Country codes (in dtype) of the side being aggregated
+            other: Country codes of the trading partners
+            values, quantities: Trade values and quantities
+            dtype: The categorical dtype the codes refer to
+            top_k: Number of partners to list per country
+            
+        The rows must already be sorted by value, largest first.
+        """
+        _known = own >= 0
+        own, other = own[_known], other[_known]
+        values, quantities = values[_known], quantities[_known]
+        
+        n_categories = len(dtype.categories)
+        counts = np.bincount(own, minlength=n_categories)
+        present = np.flatnonzero(counts)
+        counts = counts[present]
+        
+        # Like pandas' sum, missing values count as zero
+        value_sum = np.bincount(own, weights=np.nan_to_num(values), minlength=n_categories)[present]
+        quantity_sum = np.bincount(own, weights=np.nan_to_num(quantities), minlength=n_categories)[present]
+        
+        # A stable sort by country keeps each country's rows in value order,
+        # so a row's position within its country is its rank
+        order = np.argsort(own, kind='stable')
+        rank = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+        top = order[rank < top_k]
+        
+        # Code -1 (unknown partner) picks the trailing None
+        _names = np.append(np.asarray(dtype.categories, dtype=object), None)
+        top_partners = [
+            _partners.tolist()
+            for _partners in np.split(_names[other[top]], np.cumsum(np.minimum(counts, top_k))[:-1])
+        ]
+        
+        aggregate = pd.DataFrame({
+            'country': pd.Categorical.from_codes(present, dtype=dtype),
+            'value': value_sum,
+            'quantity': quantity_sum,
+            'top_partners': top_partners
+        })
+        aggregate['log_value'] = np.log10(aggregate['value'] + 1)  # +1 to handle zeros
+        return aggregate
+    
+    def set_aggregates(self):
+        """
+        Computes the exports and imports tables: total value and quantity per
+        country, and its top_k partners by value. Both tables come from one
+        sort of the edge table by value. Countries that are not ISO3 codes
+        are left out of the imports table.
+        """
+        _name = f"aggregates_top{self.top_k}"
+        tables = self._load_derived(_name, None)
+        if tables is None:
+            self._compute_aggregates()
+            self._save_derived(_name, {'exports': self._exports, 'imports': self._imports}, None)
+        else:
+            self._exports, self._imports = tables['exports'], tables['imports']
+    
+    def _compute_aggregates(self):
+        _all = self.all
+        dtype = _all['exporter'].dtype
+        _iso3 = np.asarray(dtype.categories.str.fullmatch(r'[A-Z]{3}'), dtype=bool)
+        
+        if self._matrix_layout is not None:
+            self._exports = self.matrix.aggregate(0, self.top_k)
+            imports_agg = self.matrix.aggregate(1, self.top_k)
+            self._imports = imports_agg[_iso3[imports_agg['country'].cat.codes.to_numpy()]].reset_index(drop=True)
+            return
+        
+        # One sort by value, largest first (missing values last), for both sides
+        by_value = np.argsort(-_all['value'].to_numpy(dtype=float), kind='stable')
+        exporters = _all['exporter'].cat.codes.to_numpy()[by_value]
+        partners = _all['partner'].cat.codes.to_numpy()[by_value]
+        values = _all['value'].to_numpy(dtype=float)[by_value]
+        quantities = _all['quantity'].to_numpy(dtype=float)[by_value]
+        
+        self._exports = self._aggregate_side(exporters, partners, values, quantities, dtype, self.top_k)
+        
+        imports_agg = self._aggregate_side(partners, exporters, values, quantities, dtype, self.top_k)
+        self._imports = imports_agg[_iso3[imports_agg['country'].cat.codes.to_numpy()]].reset_index(drop=True)
+        
     def set_exports(self):
-        exports_agg = self.all.sort_values(
-            by=['exporter', 'value'],
-            ascending=[True, False]    
-        ).groupby('exporter').agg(
-            value=('value', 'sum'),
-            quantity=('quantity', 'sum'),
-            top5_partners=('partner', lambda x: x.head(5).tolist())
-        ).reset_index().rename(
-            columns={'exporter': 'country'}
-        )
-
-        exports_agg['log_value'] = np.log10(exports_agg['value'] + 1)  # +1 to handle zeros
-
-        self._exports = exports_agg
+        self.set_aggregates()
         
     def set_imports(self):
-        imports_agg = self.all.sort_values(
-            by=['partner', 'value'],
-            ascending=[True, False]    
-        ).groupby('partner').agg(
-            value=('value', 'sum'),
-            quantity=('quantity', 'sum'),
-            top5_partners=('exporter', lambda x: x.head(5).tolist())
-        ).reset_index().rename(
-            columns={'partner': 'country'}
-        )
-
-        imports_agg = imports_agg[imports_agg['country'].apply(lambda code: re.match(r'^[A-Z]{3}$', code) is not None)]
-
-        imports_agg['log_value'] = np.log10(imports_agg['value'] + 1)  # +1 to handle zeros
+        self.set_aggregates()
+        
+    def set_flows(self):
+        """
+        Adds log values of every flow and their share of the largest log value
+        for the same exporter ('export_share') and the same partner ('import_share').
+        Shares are in [0, 1] and are used to scale flow line widths.
+        """
+        tables = self._load_derived("flows", None)
+        if tables is None:
+            self._compute_flows()
+            self._save_derived("flows", {'flows': self._flows}, None)
+        else:
+            self._flows = tables['flows']
+    
+    def _compute_flows(self):
+        if self._matrix_layout is not None:
+            self._flows = self.matrix.flows()
+            return
+        
+        flows = self.all.copy()
         
-        self._imports = imports_agg
+        _value = flows['value'].to_numpy(dtype=float)
+        flows['log_value'] = np.log10(np.where(_value < 1, 1, _value))
+        
+        for share_col, country_col in (('export_share', 'exporter'), ('import_share', 'partner')):
+            max_log = flows.groupby(country_col, observed=True)['log_value'].transform('max')
+            flows[share_col] = (flows['log_value'] / max_log.where(max_log > 0)).fillna(0)
+        
+        self._flows = flows
         
     @property
     def exports(self) -> pd.DataFrame:
@@ -88,4 +287,91 @@ class ComtradeData:
             self.set_imports()
         return self._imports
     
+    @property
+    def flows(self) -> pd.DataFrame:
+        if self._flows is None:
+            self.set_flows()
+        return self._flows
+    
+    def memory_usage(self) -> int:
+        """Bytes used by the loaded data and the aggregates and derived tables computed so far"""
+        _derived = [_df for _tables in self._derived.values() for _df in _tables.values()
+                    if isinstance(_df, pd.DataFrame)]
+        return sum(
+            int(_df.memory_usage(deep=True).sum())
+            for _df in [self._data, self._exports, self._imports, self._flows] + _derived
+            if _df is not None
+        ) + (self._matrix.nbytes if self._matrix is not None else 0)
+
+
+class ComtradeDataCache:
+    """
+    Keeps ComtradeData objects, with the aggregates they have computed, in memory.
+    The least recently used entries are dropped once the entries together use
+    more than max_bytes.
+    """
+    def __init__(self, max_bytes: int = 512 * 2**20):
+        self.hits = 0
+        self.misses = 0
+        self._entries = ByteLRU(max_bytes, lambda data: data.memory_usage())
+        self._last_key = None
+        self._lock = threading.Lock()
+        
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @property
+    def max_bytes(self) -> int:
+        return self._entries.max_bytes
+    
+    @property
+    def nbytes(self) -> int:
+        return self._entries.nbytes
+    
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes
+        }
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._last_key = None
+    
+    def _remeasure(self, key: tuple[str, int]):
+        # Aggregates are computed lazily after an entry is handed out,
+        # so the previously returned entry may have grown since it was measured
+        self._entries.remeasure(*{key, self._last_key})
+        self._last_key = key
+    
+    def get(self, commodity_code: int | str, period: int) -> ComtradeData:
+        """
+        Returns the cached ComtradeData for the commodity and period,
+        loading it if it is not cached.
+        """
+        key = (DataGetter.parse_commodity_code(commodity_code), int(period))
+        
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self.hits += 1
+                self._remeasure(key)
+                return data
+            self.misses += 1
+        
+        data = ComtradeData(commodity_code=key[0], period=key[1])
+        
+        with self._lock:
+            self._entries.put(key, data)
+            self._remeasure(key)
+        
+        return data
+
+
+data_cache = ComtradeDataCache()
+    
     
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Streams a plotly figure to a standalone HTML page.
+
+Unlike fig.to_html(), the page is never built as one string: the head, the
+plotly.js bundle, the figure JSON (one trace at a time) and any extra script
+are written straight to the output file(s).
+
+The figure JSON is made smaller on the way out:
+    - floats are rounded to a fixed number of decimals,
+    - style attributes that many traces share (line, marker, mode, ...) are
+      written once in a 'styles' list, and each trace refers to its style
+      by index. The page merges them back before calling Plotly.newPlot.
+"""
+
+
+import json
+
+import numpy as np
+
+
+# Trace attributes that are moved into the shared styles list
+STYLE_KEYS = ("type", "mode", "locationmode", "line", "marker", "visible", "showlegend", "hovertemplate")
+
+# Decimals kept for floats in the figure JSON
+FLOAT_DECIMALS = 3
+
+_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8" />
+    <style>html, body {height: 100%;}</style>
+</head>
+<body>
+    <div style="height:100%; width:100%;">
+        <script type="text/javascript">window.PlotlyConfig = {MathJaxConfig: 'local'};</script>
+"""
+
+# Rebuilds the traces from [style index, own attributes] pairs. Each trace
+# gets its own copy of the style, so restyling one trace leaves the others alone.
+_MERGE_STYLES = """
+            var data = traces.map(function(t) {
+                return Object.assign(JSON.parse(JSON.stringify(styles[t[0]])), t[1]);
+            });
+"""
+
+
+class Tee:
+    """Writes the same text to several open files"""
+    def __init__(self, *files):
+        self.files = files
+
+    def write(self, text: str):
+        for _f in self.files:
+            _f.write(text)
+
+
+def round_floats(obj, decimals: int = FLOAT_DECIMALS):
+    """Rounds the floats in nested dicts, lists, tuples and numpy arrays"""
+    if isinstance(obj, float):
+        return round(obj, decimals)
+    if isinstance(obj, dict):
+        return {k: round_floats(v, decimals) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [round_floats(v, decimals) for v in obj]
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == 'f':
+            return obj.round(decimals)
+        if obj.dtype.kind == 'O':
+            return [round_floats(v, decimals) for v in obj.tolist()]
+    return obj
+
+
+def to_json(obj) -> str:
+    """
+    Compact JSON, using plotly's encoder for numpy values, that is safe to embed
+    in a <script>: like plotly's to_html, "</" is escaped so that a label
+    containing "</script>" cannot end the script, and so is "<!--"
+    """
+    from plotly.utils import PlotlyJSONEncoder
+    _json = json.dumps(obj, cls=PlotlyJSONEncoder, separators=(',', ':'))
+    return _json.replace("<!--", "\\u003c!--").replace("</", "<\\/")
+
+
+def split_style(trace: dict) -> tuple[dict, dict]:
+    """Splits a trace dict into its shared style attributes and the rest"""
+    style = {k: trace[k] for k in STYLE_KEYS if k in trace}
+    own = {k: v for k, v in trace.items() if k not in style}
+    return style, own
+
+
+def _plotlyjs_tag(include_plotlyjs) -> str:
+    """
+    Args:
+        include_plotlyjs: True to inline the bundle, "cdn" for the plotly CDN,
+            a path/URL ending in .js to load it from there, False for none
+    """
+    if include_plotlyjs is True:
+        from plotly.offline import get_plotlyjs
+        return f'<script type="text/javascript">{get_plotlyjs()}</script>'
+    if include_plotlyjs == "cdn":
+        from plotly.io._utils import plotly_cdn_url
+        return f'<script charset="utf-8" src="{plotly_cdn_url()}"></script>'
+    if isinstance(include_plotlyjs, str) and include_plotlyjs.endswith(".js"):
+        return f'<script charset="utf-8" src="{include_plotlyjs}"></script>'
+    return ""
+
+
+def write_figure_html(out, fig, div_id: str, include_plotlyjs=True, post_script: str = "",
+                      decimals: int = FLOAT_DECIMALS) -> dict:
+    """
+    Writes the figure as a standalone HTML page.
+
+    Args:
+        out: Object with a write(str) method, e.g. an open file or a Tee
+        fig: plotly Figure
+        div_id: id of the plot div
+        include_plotlyjs: See _plotlyjs_tag
+        post_script: HTML inserted before </body>, e.g. event handlers
+        decimals: Decimals kept for floats
+
+    Returns:
+        dict: Number of 'traces' and of distinct 'styles' written
+    """
+    out.write(_HEAD)
+    out.write(_plotlyjs_tag(include_plotlyjs))
+    out.write(f'\n        <div id="{div_id}" class="plotly-graph-div" style="height:100%; width:100%;"></div>\n')
+    out.write('        <script type="text/javascript">\n')
+    out.write('            window.PLOTLYENV=window.PLOTLYENV || {};\n')
+
+    styles: dict[str, int] = {}
+    out.write('            var traces = [\n')
+    for i, trace in enumerate(fig.data):
+        style, own = split_style(round_floats(trace.to_plotly_json(), decimals))
+        _style = to_json(style)
+        _index = styles.setdefault(_style, len(styles))
+        out.write(f'{"," if i else ""}[{_index},{to_json(own)}]\n')
+    out.write('            ];\n')
+    out.write(f'            var styles = [{",".join(styles)}];\n')
+    out.write(_MERGE_STYLES)
+
+    _layout = to_json(round_floats(fig.layout.to_plotly_json(), decimals))
+    out.write(f'            var layout = {_layout};\n')
+    out.write(f'            if (document.getElementById("{div_id}")) {{\n')
+    out.write(f'                Plotly.newPlot("{div_id}", data, layout, {{"responsive": true}});\n')
+    out.write('            }\n')
+    out.write('        </script>\n')
+    out.write('    </div>\n')
+    out.write(post_script)
+    out.write('\n</body>\n</html>\n')
+
+    return {'traces': len(fig.data), 'styles': len(styles)}
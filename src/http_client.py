@@ -0,0 +1,140 @@
+"""
+Long-lived HTTP client for the Comtrade API.
+
+One HttpClient keeps a pool of keep-alive connections open, and retries
+throttled (429), unavailable (5xx) and failed requests with jittered
+exponential backoff, honouring the server's Retry-After header.
+"""
+
+
+import time
+import random
+import email.utils
+import urllib3
+
+
+COMTRADE_API_URL = "https://comtradeapi.un.org"
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _retry_after_seconds(value: str | None) -> float | None:
+    """Parse a Retry-After header, given either as seconds or as an HTTP date"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        _date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, _date.timestamp() - time.time())
+
+
+class HttpClient:
+    def __init__(self,
+                 base_url: str = COMTRADE_API_URL,
+                 connect_timeout: float = 10.0,
+                 read_timeout: float = 120.0,
+                 retries: int = 5,
+                 backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 pool_size: int = 8,
+                 verify: bool = False,
+                 rate_limiter=None):
+        """
+        Args:
+            base_url: Scheme and host that request paths are relative to
+            connect_timeout: Seconds to wait for a connection
+            read_timeout: Seconds to wait for the response
+            retries: How many times a failed request is retried
+            backoff: Base delay in seconds, doubled on every retry
+            max_backoff: Upper limit for a single delay, including Retry-After
+            pool_size: Connections kept open to the host
+            verify: Whether to verify TLS certificates
+            rate_limiter: Optional rate_limit.RateLimiter; every attempt,
+                including retries, waits for it
+        """
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limiter = rate_limiter
+
+        if not verify:
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+        self._pool = urllib3.PoolManager(
+            num_pools=4,
+            maxsize=pool_size,
+            block=True,
+            cert_reqs='CERT_REQUIRED' if verify else 'CERT_NONE',
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+            # Retries are handled in request() so that Retry-After and jitter apply
+            retries=False
+        )
+
+    def _delay(self, attempt: int, retry_after: float | None = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        # "Full jitter": a random delay up to the exponential backoff
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, 
+                method: str, 
+                path: str, 
+                headers: dict = None, 
+                fields: dict = None, 
+                preload_content: bool = True):
+        """
+        Sends a request, retrying on throttling, server errors and connection
+        failures.
+
+        Args:
+            method: HTTP method
+            path: Path relative to base_url, or a full URL
+            headers: Request headers
+            fields: Query parameters
+            preload_content: If True the body is read in full, so the connection
+                goes straight back to the pool. If False the caller reads it with
+                response.stream() and then calls response.release_conn()
+
+        Returns:
+            urllib3.BaseHTTPResponse: The last response received. Its status
+                is a retryable error if all retries were used up.
+        """
+        url = path if "://" in path else self.base_url + path
+
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = self._pool.request(
+                    method, url, headers=headers, fields=fields, preload_content=preload_content
+                )
+            except (urllib3.exceptions.TimeoutError,
+                    urllib3.exceptions.ProtocolError,
+                    urllib3.exceptions.NewConnectionError):
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self._delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status not in RETRY_STATUSES or attempt >= self.retries:
+                return response
+
+            if not preload_content:
+                response.drain_conn()
+                response.release_conn()
+
+            time.sleep(self._delay(attempt, _retry_after_seconds(response.headers.get('Retry-After'))))
+            attempt += 1
+
+    def get(self, path: str, headers: dict = None, fields: dict = None, preload_content: bool = True):
+        return self.request('GET', path, headers=headers, fields=fields, preload_content=preload_content)
+
+    def close(self):
+        self._pool.clear()
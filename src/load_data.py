@@ -1,17 +1,43 @@
 import os
 import sys
 import inspect
-import urllib3
-import requests
-import json
 import pandas as pd
 import numpy as np
 import re
+from contextlib import ExitStack
    
 from codes.get_codes import codes
+from paths import get_api_key
+from stream_parse import read_columns
+from cache_formats import CACHE_FORMATS, CacheFormat, JsonCache, get_cache_format
+from file_lock import FileLock, atomic_path
+    
+    
+class TruncatedResponse(Exception):
+    """Raised when the API returns as many records as were asked for, so more may be missing"""
     
     
 class DataGetter:
+    # Limits of the Comtrade get/C/A/HS endpoint. Records are capped at the
+    # largest maxRecords the API accepts with a subscription key
+    MAX_PERIODS_PER_REQUEST = 12
+    MAX_COMMODITIES_PER_REQUEST = 20
+    MAX_RECORDS_PER_REQUEST = 250000
+    
+    # The only fields of a response record that are kept, and their types
+    RESPONSE_FIELDS = {
+        'cmdCode': 'category',
+        'period': 'category',
+        'reporterCode': 'int',
+        'partnerCode': 'int',
+        'qty': 'float',
+        'primaryValue': 'float',
+    }
+    STREAM_CHUNK_SIZE = 1 << 16
+    
+    # Subdirectory of a commodity's cache directory for tables derived from its data
+    DERIVED_DIR = "derived"
+    
     @staticmethod
     def parse_commodity_code(commodity_code: int | str) -> str:
         """
@@ -32,33 +58,85 @@ class DataGetter:
             c = "0"+c
             if c in codes.hs_to_desc:
                 return c
-            raise ValueError(f"Invalid commodity code: {commodity_code}.")
+            raise ValueError(DataGetter._invalid_code_message(commodity_code))
         elif isinstance(commodity_code, str):
             if re.match(r'^\d+$', commodity_code):
                 # If the commodity code is a string of digits, check if its in the list
                 if commodity_code in codes.hs_to_desc:
                     return commodity_code
-                ValueError(f"Invalid commodity code: {commodity_code}.")
+                raise ValueError(DataGetter._invalid_code_message(commodity_code))
             elif commodity_code.lower() in codes.desc_to_hs:
                 # If the commodity code is a string that matches a known commodity, get its code
                 return codes.desc_to_hs[commodity_code.lower()]
             else:
-                raise ValueError(f"Invalid commodity code: {commodity_code}.")
+                raise ValueError(DataGetter._invalid_code_message(commodity_code))
         else:
             raise TypeError(f"Commodity code must be an int or str, got {type(commodity_code)}.")
+    
+    @staticmethod
+    def _invalid_code_message(commodity_code: int | str) -> str:
+        _suggestions = codes.commodity_index.search(str(commodity_code), limit=5)
+        if not _suggestions:
+            return f"Invalid commodity code: {commodity_code}."
+        _options = "; ".join(f"{c} ({d})" for c, d, _ in _suggestions)
+        return f"Invalid commodity code: {commodity_code}. Did you mean: {_options}?"
         
     @staticmethod
     def commodity_code_desc(commodity_code: int | str) -> str:
         _c = DataGetter.parse_commodity_code(commodity_code)
         return codes.hs_to_desc[_c]
     
-    def __init__(self, _dir: str, api_key: str = None):
+    def __init__(self, 
+                 _dir: str, 
+                 api_key: str = None, 
+                 cache_format: str | CacheFormat = None,
+                 http_client=None,
+                 store=None):
+        """
+        Args:
+            _dir: Directory for the cached data
+            api_key: Comtrade API subscription key
+            cache_format: Name of a format in cache_formats.CACHE_FORMATS, a CacheFormat
+                instance, or None to use Feather if pyarrow is installed and npz otherwise
+            http_client: http_client.HttpClient used for all API requests. Defaults
+                to one for the Comtrade API with its default retry settings
+            store: flow_store.FlowStore, or the path of its database, that every
+                table written to the cache is also written to. None for no store
+        """
+        if isinstance(cache_format, str) and cache_format not in CACHE_FORMATS:
+            raise ValueError(f"Invalid cache format: {cache_format}. Expected one of {list(CACHE_FORMATS)}.")
+        
         self._dir = _dir
         self._key = api_key
+        # The HTTP client and cache format are set up on first use
+        self._http = http_client
+        self._cache_format = cache_format
+        self._cache = cache_format if isinstance(cache_format, CacheFormat) else None
+        self.set_store(store)
+        
+    def set_store(self, store):
+        """Sets the flow_store.FlowStore (or database path) that cached tables are written through to"""
+        if isinstance(store, str):
+            from flow_store import FlowStore
+            store = FlowStore(store)
+        self.store = store
         
     def set_api_key(self, api_key: str):
         self._key = api_key
         
+    @property
+    def http_client(self):
+        if self._http is None:
+            from http_client import HttpClient
+            self._http = HttpClient()
+        return self._http
+    
+    @property
+    def cache(self) -> CacheFormat:
+        if self._cache is None:
+            self._cache = get_cache_format(self._cache_format)
+        return self._cache
+        
     def _commodity_dir(self, commodity_code: int | str):
         _c = self.parse_commodity_code(commodity_code)
         _p = os.path.join(
@@ -72,12 +150,41 @@ class DataGetter:
     def file(self, commodity_code: int | str, period: int) -> str:
         _p = os.path.join(
             self._commodity_dir(commodity_code),
-            f"annual{period}.json"
+            f"annual{period}{self.cache.extension}"
         )
         return _p
+    
+    def _json_file(self, commodity_code: int | str, period: int) -> str:
+        # Cache files written before the cache format was configurable
+        return os.path.join(
+            self._commodity_dir(commodity_code),
+            f"annual{period}.json"
+        )
+        
+    def _lock(self, commodity_code: int | str, period: int) -> FileLock:
+        """
+        Cross-process lock on one (commodity, period). Whoever holds it is the only
+        one downloading or migrating that cell, whatever the cache format.
+        """
+        return FileLock(os.path.join(self._commodity_dir(commodity_code), f"annual{period}"))
         
     def file_exists(self, commodity_code: int | str, period: int) -> bool:
-        return os.path.exists(self.file(commodity_code, period))
+        return os.path.exists(self.file(commodity_code, period)) \
+            or os.path.exists(self._json_file(commodity_code, period))
+    
+    def _migrate_json_cache(self, commodity_code: int | str, period: int):
+        """
+        Rewrites an old JSON cache file in the configured cache format
+        and removes the JSON file.
+        """
+        _json = self._json_file(commodity_code, period)
+        _fp = self.file(commodity_code, period)
+        if _json == _fp or not os.path.exists(_json):
+            return
+        
+        df = JsonCache().read(_json)
+        self._write(df, self.parse_commodity_code(commodity_code), period)
+        os.remove(_json)
     
     @staticmethod
     def tidy_annual_export_data(df: pd.DataFrame) -> pd.DataFrame:
@@ -117,72 +224,316 @@ class DataGetter:
             by=["exporter_m49", "partner_m49"]
         ).reset_index(drop=True)
         
-        # Load metadata for M49 to ISO3 mapping
-        m49iso_map: dict = codes.m49_to_iso
-        
-        # Replace M49 codes with ISO3
-        _df['exporter'] = _df['exporter_m49'].apply(m49iso_map.get)
-        _df['partner'] = _df['partner_m49'].apply(m49iso_map.get)
+        # Replace M49 codes with ISO3, as categories of the shared country dtype
+        _df['exporter'] = DataGetter.m49_to_country(_df['exporter_m49'].to_numpy())
+        _df['partner'] = DataGetter.m49_to_country(_df['partner_m49'].to_numpy())
         
         _df.drop(columns=['exporter_m49', 'partner_m49'], inplace=True)
             
         return _df
+    
+    @staticmethod
+    def m49_to_country(m49: np.ndarray) -> pd.Categorical:
+        """
+        Maps an array of M49 codes to ISO3 codes with one array lookup.
+        Unknown codes become missing values.
+        """
+        _lookup = codes.m49_lookup
+        m49 = np.asarray(m49, dtype=np.int64)
+        _known = (m49 >= 0) & (m49 < len(_lookup))
+        _codes = np.full(len(m49), -1, dtype=_lookup.dtype)
+        _codes[_known] = _lookup[m49[_known]]
+        return pd.Categorical.from_codes(_codes, dtype=codes.country_dtype)
+    
+    @staticmethod
+    def as_country_categories(df: pd.DataFrame) -> pd.DataFrame:
+        """Converts the exporter and partner columns to the shared country dtype"""
+        for col in ('exporter', 'partner'):
+            if df[col].dtype != codes.country_dtype:
+                df[col] = df[col].astype(codes.country_dtype)
+        return df
         
-    def _download_data(self, 
-                     commodity_code: int | str,
-                     period: int) -> int:
+    def _write(self, df: pd.DataFrame, commodity_code: str, period: int):
+        """Writes a tidied table to the cache, and through to the store if there is one"""
+        # Readers see the old file or the whole new one, never a partial write
+        with atomic_path(self.file(commodity_code, period)) as _tmp:
+            self.cache.write(df, _tmp)
+        if self.store is not None:
+            self.store.write(commodity_code, period, df)
+        
+        _panel = self.panel(commodity_code)
+        if _panel.exists():
+            if int(period) in _panel.index['periods']:
+                # A period cannot be replaced in place; load_panel() rebuilds the panel
+                _panel.clear()
+            else:
+                _panel.append(period, df)
+        
+    def backfill_store(self) -> int:
         """
-        Fetches the COMTRADE data for a specific period.
+        Writes every cached table that is not in the store yet to the store.
+        
+        Returns:
+            int: The number of tables written.
+        """
+        if self.store is None:
+            raise ValueError("No store set, see set_store().")
+        
+        written = 0
+        for _entry in sorted(os.listdir(self._dir)) if os.path.isdir(self._dir) else []:
+            _match = re.fullmatch(r"hs(\d+)", _entry)
+            if not _match:
+                continue
+            _code = _match.group(1)
+            for _p in self.cached_periods(_code):
+                if not self.store.has(_code, _p):
+                    self.store.write(_code, _p, self.load(_code, _p))
+                    written += 1
+        return written
+    
+    def cached_periods(self, commodity_code: int | str) -> list[int]:
+        """The periods of a commodity that are cached, in either format"""
+        _d = os.path.join(self._dir, f"hs{self.parse_commodity_code(commodity_code)}")
+        if not os.path.isdir(_d):
+            return []
+        _periods = set()
+        for _file in os.listdir(_d):
+            _match = re.fullmatch(r"annual(\d{4})(\.\w+)", _file)
+            if _match and _match.group(2) in (self.cache.extension, ".json"):
+                _periods.add(int(_match.group(1)))
+        return sorted(_periods)
+    
+    def panel(self, commodity_code: int | str):
+        """The panel.Panel of a commodity, which may not have been built yet"""
+        from panel import Panel, PANEL_DIR
+        return Panel(os.path.join(self._dir, f"hs{self.parse_commodity_code(commodity_code)}", PANEL_DIR))
+    
+    def load_panel(self, 
+                   commodity_code: int | str, 
+                   periods: list[int] = None, 
+                   download: bool = False) -> pd.DataFrame:
+        """
+        Every cached period of a commodity as one long table, read from a
+        memory-mapped panel (see panel.py). The panel is built on first use,
+        and is then kept up to date as periods are cached.
         
         Args:
-            commodity_code (int): The HS commodity code to filter the data.
-            period (int): The year for which to fetch the data.
+            commodity_code (int | str): HS code or description.
+            periods (list[int]): Years to return, None for every cached year.
+            download (bool): Download the given periods that are not cached first.
             
         Returns:
-            pd.DataFrame: DataFrame containing the COMTRADE data.
+            pd.DataFrame: 'period', 'exporter', 'partner', 'value' and 'quantity'.
         """
-        if self._key is None:
-            key = get_api_key()
-        else:
-            key = self._key
-
-        commodity_code = self.parse_commodity_code(commodity_code)
+        _c = self.parse_commodity_code(commodity_code)
+        if download and periods is not None:
+            self.load_many([_c], periods)
         
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        panel = self.panel(_c)
+        for _p in self.cached_periods(_c):
+            if _p not in panel.index['periods']:
+                panel.append(_p, self.load(_c, _p))
+        return panel.open(periods)
+    
+    def _request_data(self,
+                      commodity_codes: list[str],
+                      periods: list[int]) -> pd.DataFrame:
+        """
+        Requests raw export records for every combination of the given
+        commodity codes and periods in a single API call. The response is
+        parsed as it arrives and only the RESPONSE_FIELDS are kept.
         
-        # Initialize the HTTP connection pool
-        http = urllib3.PoolManager(cert_reqs='CERT_NONE')
+        Args:
+            commodity_codes (list[str]): Parsed HS commodity codes.
+            periods (list[int]): Years to fetch.
+            
+        Returns:
+            pd.DataFrame: The RESPONSE_FIELDS of the records, possibly empty.
+        """
+        if self._key is None:
+            self._key = get_api_key()
+        key = self._key
         
-        response = http.request(
-            method='GET', 
-            url="https://comtradeapi.un.org/data/v1/get/C/A/HS", 
+        response = self.http_client.get(
+            "/data/v1/get/C/A/HS", 
             headers={
                 'Cache-Control': 'no-cache',
                 'Ocp-Apim-Subscription-Key': key,
             },
             fields={
-                'cmdCode': f'{commodity_code}',
+                'cmdCode': ','.join(str(c) for c in commodity_codes),
                 'flowCode': 'X',
-                'period': f'{period}',
+                'period': ','.join(str(p) for p in periods),
+                'maxRecords': f'{self.MAX_RECORDS_PER_REQUEST}',
                 'includeDesc': 'false'
-            }
+            },
+            preload_content=False
         )
         
-        if response.status != 200:
-            raise Exception(f"Error fetching data: {response.status}")
+        try:
+            if response.status != 200:
+                raise Exception(f"Error fetching data: {response.status}")
+            
+            return read_columns(response.stream(self.STREAM_CHUNK_SIZE), self.RESPONSE_FIELDS)
+        finally:
+            response.release_conn()
+    
+    def _check_complete(self, df: pd.DataFrame, commodity_code: str, period: int):
+        """
+        Raises TruncatedResponse if the response for a single (commodity, period)
+        hit MAX_RECORDS_PER_REQUEST. Such a cell cannot be split any further, and
+        is never written to the cache as if it were complete.
+        """
+        if len(df) >= self.MAX_RECORDS_PER_REQUEST:
+            raise TruncatedResponse(
+                f"The response for commodity {commodity_code} in {period} was cut off at "
+                f"{self.MAX_RECORDS_PER_REQUEST} records; it was not cached."
+            )
         
-        data = json.loads(response.data.decode('utf-8'))
+    def _download_data(self, 
+                     commodity_code: int | str,
+                     period: int) -> int:
+        """
+        Fetches the COMTRADE data for a specific period.
+        
+        Args:
+            commodity_code (int): The HS commodity code to filter the data.
+            period (int): The year for which to fetch the data.
+            
+        Returns:
+            pd.DataFrame: DataFrame containing the COMTRADE data.
+        """
+        commodity_code = self.parse_commodity_code(commodity_code)
         
-        df = pd.DataFrame(data['data'])
+        df = self._request_data([commodity_code], [period])
         if df.empty:
             raise ValueError("No data returned for the specified period.")
+        self._check_complete(df, commodity_code, period)
         
         df = self.tidy_annual_export_data(df)
 
-        df.to_json(self.file(commodity_code, period), orient='records', indent=2)
+        self._write(df, commodity_code, period)
 
         return 0
     
+    def _download_batch(self,
+                        commodity_codes: list[str],
+                        periods: list[int]) -> list[tuple[str, int]]:
+        """
+        Fetches several commodities and periods in one request and writes each
+        (commodity, period) slice of the response to its own cache file.
+        If the response is truncated at MAX_RECORDS_PER_REQUEST the batch is
+        split in two along its larger dimension and each half is fetched again.
+        A single cell that is still truncated raises TruncatedResponse.
+        
+        Returns:
+            list[tuple[str, int]]: The (commodity, period) pairs that were written.
+        """
+        df = self._request_data(commodity_codes, periods)
+        
+        if len(commodity_codes) == 1 and len(periods) == 1:
+            self._check_complete(df, commodity_codes[0], periods[0])
+        elif len(df) >= self.MAX_RECORDS_PER_REQUEST:
+            if len(commodity_codes) >= len(periods):
+                _m = len(commodity_codes) // 2
+                halves = [(commodity_codes[:_m], periods), (commodity_codes[_m:], periods)]
+            else:
+                _m = len(periods) // 2
+                halves = [(commodity_codes, periods[:_m]), (commodity_codes, periods[_m:])]
+            return [key for _c, _p in halves for key in self._download_batch(_c, _p)]
+        
+        if df.empty:
+            return []
+        
+        written = []
+        for (_code, _period), _slice in df.groupby([df['cmdCode'].astype(str), df['period'].astype(int)]):
+            if _code not in commodity_codes or _period not in periods:
+                continue
+            self._write(self.tidy_annual_export_data(_slice), _code, _period)
+            written.append((_code, _period))
+        
+        return written
+    
+    def missing_batches(self, 
+                        commodity_codes: list[str], 
+                        periods: list[int]) -> list[tuple[list[str], list[int]]]:
+        """
+        Packs the uncached (commodity, period) cells into request-sized batches.
+        Every cell of a batch's commodity × period product is uncached.
+        
+        Args:
+            commodity_codes (list[str]): Parsed HS commodity codes.
+            periods (list[int]): Years.
+            
+        Returns:
+            list[tuple[list[str], list[int]]]: (commodity codes, periods) for each request.
+        """
+        # Commodities that are missing the same set of periods can share requests
+        missing = {}
+        for _c in commodity_codes:
+            _missing_periods = tuple(p for p in periods if not self.file_exists(_c, p))
+            if _missing_periods:
+                missing.setdefault(_missing_periods, []).append(_c)
+        
+        batches = []
+        for _missing_periods, _missing_codes in missing.items():
+            for i in range(0, len(_missing_codes), self.MAX_COMMODITIES_PER_REQUEST):
+                for j in range(0, len(_missing_periods), self.MAX_PERIODS_PER_REQUEST):
+                    batches.append((
+                        _missing_codes[i:i + self.MAX_COMMODITIES_PER_REQUEST],
+                        list(_missing_periods[j:j + self.MAX_PERIODS_PER_REQUEST])
+                    ))
+        return batches
+    
+    def download_batch(self,
+                       commodity_codes: list[str],
+                       periods: list[int]) -> list[tuple[str, int]]:
+        """
+        Downloads a batch from missing_batches() while holding the lock of each of
+        its cells, skipping the cells that another worker cached in the meantime.
+        
+        Returns:
+            list[tuple[str, int]]: The (commodity, period) pairs that were written.
+        """
+        written = []
+        with ExitStack() as _locks:
+            # Cells are always locked in the same order, so two workers with
+            # overlapping batches cannot each hold a cell the other waits for
+            for _c, _p in sorted((c, p) for c in commodity_codes for p in periods):
+                _locks.enter_context(self._lock(_c, _p))
+            for _still_codes, _still_periods in self.missing_batches(commodity_codes, periods):
+                written += self._download_batch(_still_codes, _still_periods)
+        return written
+    
+    def load_many(self, 
+                  commodity_codes: list[int | str], 
+                  periods: list[int]) -> dict[tuple[str, int], pd.DataFrame]:
+        """
+        Fetches the COMTRADE data for every combination of commodity and period,
+        downloading the cells that are not cached in as few requests as the
+        API limits allow.
+        
+        Args:
+            commodity_codes (list[int | str]): HS commodity codes or descriptions.
+            periods (list[int]): The years for which to fetch the data.
+            
+        Returns:
+            dict[tuple[str, int], pd.DataFrame]: Data keyed by (parsed commodity code, period).
+                Cells for which the API returned no data are left out.
+        """
+        _codes = list(dict.fromkeys(self.parse_commodity_code(c) for c in commodity_codes))
+        _periods = list(dict.fromkeys(int(p) for p in periods))
+        
+        for _batch_codes, _batch_periods in self.missing_batches(_codes, _periods):
+            self.download_batch(_batch_codes, _batch_periods)
+        
+        return {
+            (_c, _p): self.load(_c, _p)
+            for _c in _codes
+            for _p in _periods
+            if self.file_exists(_c, _p)
+        }
+    
     def load(self, commodity_code: int | str, period: int) -> pd.DataFrame:
         """
         Fetches the COMTRADE data for a specific period 
@@ -196,8 +547,146 @@ class DataGetter:
             pd.DataFrame: DataFrame containing the COMTRADE data.
         """
         
-        if not self.file_exists(commodity_code, period):
-            self._download_data(commodity_code, period)
+        if not os.path.exists(self.file(commodity_code, period)):
+            # Single flight: a worker that finds the cell missing while another
+            # is downloading it waits for the lock and then reads its file
+            with self._lock(commodity_code, period):
+                if not os.path.exists(self.file(commodity_code, period)):
+                    if os.path.exists(self._json_file(commodity_code, period)):
+                        self._migrate_json_cache(commodity_code, period)
+                    else:
+                        self._download_data(commodity_code, period)
 
-        return pd.read_json(self.file(commodity_code, period))
-    
\ No newline at end of file
+        return self.as_country_categories(self.cache.read(self.file(commodity_code, period)))
+        
+    def derived_file(self, commodity_code: int | str, period: int, name: str) -> str:
+        """Path of a table derived from the data of a commodity and period, see get_data.ComtradeData"""
+        return os.path.join(
+            self._dir,
+            f"hs{self.parse_commodity_code(commodity_code)}",
+            self.DERIVED_DIR,
+            f"annual{period}.{name}.pickle"
+        )
+    
+    def content_stamp(self, commodity_codes: list[str], period: int) -> tuple | None:
+        """
+        Size and modification time of the cache files of the parsed commodity
+        codes for one period, or None if one of them is not cached. Every write
+        to the cache replaces the file, so the stamp changes whenever the data
+        does, and it is read without opening the files.
+        """
+        stamp = []
+        for _c in commodity_codes:
+            _fp = self._cached_file(_c, period)
+            if _fp is None:
+                return None
+            _stat = os.stat(_fp)
+            stamp.append((_c, os.path.basename(_fp), _stat.st_size, _stat.st_mtime_ns))
+        return tuple(stamp)
+    
+    def _cached_file(self, commodity_code: str, period: int) -> str | None:
+        """
+        Path of the cache file for a parsed commodity code, in either format,
+        or None if it is not cached. Unlike file(), creates no directories.
+        """
+        _d = os.path.join(self._dir, f"hs{commodity_code}")
+        for _fp in (os.path.join(_d, f"annual{period}{self.cache.extension}"),
+                    os.path.join(_d, f"annual{period}.json")):
+            if os.path.exists(_fp):
+                return _fp
+        return None
+    
+    def rollup_sources(self, commodity_code: int | str, period: int) -> tuple[list[str], list[str]]:
+        """
+        Finds cached codes below the commodity in the HS hierarchy that together
+        cover it: each child is used if it is cached, and otherwise replaced by
+        its own children, recursively.
+        
+        Args:
+            commodity_code (int | str): HS code, usually a chapter or heading.
+            period (int): Year.
+            
+        Returns:
+            tuple[list[str], list[str]]: (cached codes, missing codes). The
+                commodity can be rolled up if no codes are missing. A missing
+                code is reported at the highest level with nothing cached below it.
+        """
+        _c = self.parse_commodity_code(commodity_code)
+        _children = codes.commodity_index.children(_c)
+        if not _children:
+            return [], [_c]
+        
+        cached, missing = [], []
+        for _child in _children:
+            if self._cached_file(_child, period) is not None:
+                cached.append(_child)
+                continue
+            _cached, _missing = self.rollup_sources(_child, period)
+            if _cached:
+                cached.extend(_cached)
+                missing.extend(_missing)
+            else:
+                missing.append(_child)
+        return cached, missing
+    
+    @staticmethod
+    def rollup(frames: list[pd.DataFrame]) -> pd.DataFrame:
+        """
+        Sums the data of several commodities per exporter-partner pair. Quantities
+        are summed as they are, whatever units the commodities report them in;
+        a pair's quantity is NaN only if it is missing for every commodity.
+        """
+        df = pd.concat(frames, ignore_index=True)
+        df = df.groupby(['exporter', 'partner'], observed=True, sort=False, dropna=False)[['quantity', 'value']] \
+            .sum(min_count=1) \
+            .reset_index()
+        return df[['quantity', 'value', 'exporter', 'partner']]
+    
+    def find_source(self, 
+                    commodity_code: int | str, 
+                    period: int, 
+                    rollup: bool = True) -> tuple[str, list[str]]:
+        """
+        How load_with_source() gets the data, without reading or downloading it.
+        
+        Returns:
+            tuple[str, list[str]]: "cache", "rollup" or "download", and the codes
+                the data is read from.
+        """
+        _c = self.parse_commodity_code(commodity_code)
+        if self._cached_file(_c, period) is not None:
+            return "cache", [_c]
+        
+        if rollup:
+            cached, missing = self.rollup_sources(_c, period)
+            if cached and not missing:
+                return "rollup", cached
+        
+        return "download", [_c]
+    
+    def load_from(self, source: str, commodity_codes: list[str], period: int) -> pd.DataFrame:
+        """Loads the data of a source found by find_source()"""
+        if source == "rollup":
+            frames = [self.load(_child, period) for _child in commodity_codes]
+            return self.as_country_categories(self.rollup(frames))
+        return self.load(commodity_codes[0], period)
+    
+    def load_with_source(self, 
+                         commodity_code: int | str, 
+                         period: int, 
+                         rollup: bool = True) -> tuple[pd.DataFrame, str, list[str]]:
+        """
+        Like load(), but builds a chapter or heading that is not cached from its
+        cached sub-codes when all of them are cached, instead of downloading it.
+        
+        Args:
+            commodity_code (int | str): HS code or description.
+            period (int): Year.
+            rollup (bool): Whether to try a roll-up before downloading.
+            
+        Returns:
+            tuple[pd.DataFrame, str, list[str]]: The data; how it was obtained,
+                "cache", "rollup" or "download"; and the codes it was read from.
+        """
+        source, source_codes = self.find_source(commodity_code, period, rollup=rollup)
+        return self.load_from(source, source_codes, period), source, source_codes
@@ -0,0 +1,206 @@
+"""
+Load test for the downloaders, run against the Comtrade API stand-in.
+
+    python3 src/main.py load-test 2201-2209 2015-2023 --workers 8 --latency 0.05 --records 5000
+
+Starts an api_standin.ComtradeStandIn in this process (or uses the one at
+--url), downloads every commodity × year with DataGetter._download_data into
+a temporary directory, and reports requests/s, bytes/s and latency
+percentiles. With --metadata the MetaData._download_* methods are timed too.
+"""
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from api_standin import ComtradeStandIn, STATS_PATH, HSCODES_PATH, COUNTRY_DATA_PATH, add_standin_arguments
+
+
+PERCENTILES = (50, 90, 99)
+
+
+def _server_stats(base_url: str) -> dict | None:
+    import urllib3
+    try:
+        response = urllib3.request("GET", base_url + STATS_PATH, timeout=5.0, retries=False)
+    except urllib3.exceptions.HTTPError:
+        return None
+    return json.loads(response.data) if response.status == 200 else None
+
+
+def _latency_summary(seconds: list[float]) -> dict:
+    if not seconds:
+        return {}
+    _s = np.asarray(seconds)
+    summary = {f"p{p}": float(np.percentile(_s, p)) for p in PERCENTILES}
+    summary.update(mean=float(_s.mean()), max=float(_s.max()))
+    return summary
+
+
+def _download_metadata(base_url: str, directory: str) -> dict:
+    """Times each MetaData._download_* method once"""
+    from codes.get_codes import MetaData
+
+    meta = MetaData(
+        os.path.join(directory, "codes"),
+        country_data_url=base_url + COUNTRY_DATA_PATH,
+        hscodes_url=base_url + HSCODES_PATH
+    )
+    timings = {}
+    for _name in ("_download_m49_to_iso", "_download_iso_to_name", "_download_hscodes"):
+        t0 = time.perf_counter()
+        getattr(meta, _name)()
+        timings[_name] = time.perf_counter() - t0
+    return timings
+
+
+def run_load_test(base_url: str,
+                  commodity_codes: list[str],
+                  periods: list[int],
+                  workers: int = 4,
+                  metadata: bool = False,
+                  retries: int = 5,
+                  backoff: float = 0.1) -> dict:
+    """
+    Downloads every commodity and period from the server at base_url.
+
+    Args:
+        base_url: URL of a stand-in (or the real API)
+        commodity_codes: Parsed HS commodity codes
+        periods: Years
+        workers: Concurrent downloads
+        metadata: Also time the MetaData downloads
+        retries: Retries per request, see http_client.HttpClient
+        backoff: Base retry delay in seconds
+
+    Returns:
+        dict: Counts, throughput and latency percentiles
+    """
+    from http_client import HttpClient
+    from load_data import DataGetter
+
+    jobs = [(c, p) for c in commodity_codes for p in periods]
+    client = HttpClient(base_url, pool_size=workers, retries=retries, backoff=backoff, max_backoff=5.0)
+    _before = _server_stats(base_url)
+
+    with tempfile.TemporaryDirectory(prefix="comtrade-load-test-") as _dir:
+        getter = DataGetter(_dir=_dir, api_key="load-test", http_client=client)
+
+        def _timed(job):
+            t0 = time.perf_counter()
+            try:
+                getter._download_data(*job)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            return time.perf_counter() - t0, error
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_timed, jobs))
+        elapsed = time.perf_counter() - t0
+        _after = _server_stats(base_url)
+
+        metadata_seconds = _download_metadata(base_url, _dir) if metadata else None
+
+    client.close()
+
+    latencies = [s for s, e in results if e is None]
+    errors = [e for _, e in results if e is not None]
+    summary = {
+        'downloads': len(jobs),
+        'failed': len(errors),
+        'errors': sorted(set(errors))[:5],
+        'workers': workers,
+        'elapsed_seconds': elapsed,
+        'downloads_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_seconds': _latency_summary(latencies),
+        'metadata_seconds': metadata_seconds,
+    }
+    if _before is not None and _after is not None:
+        # The server's counts include retried and throttled requests
+        _requests = _after['requests'] - _before['requests']
+        _bytes = _after['bytes_sent'] - _before['bytes_sent']
+        summary.update(
+            requests=_requests,
+            throttled=_after['throttled'] - _before['throttled'],
+            bytes=_bytes,
+            requests_per_second=_requests / elapsed if elapsed else 0.0,
+            bytes_per_second=_bytes / elapsed if elapsed else 0.0
+        )
+    return summary
+
+
+def print_report(summary: dict):
+    print(f"Downloads:  {summary['downloads'] - summary['failed']}/{summary['downloads']} ok "
+          f"in {summary['elapsed_seconds']:.2f}s with {summary['workers']} workers "
+          f"({summary['downloads_per_second']:.1f}/s)")
+    if 'requests' in summary:
+        print(f"Requests:   {summary['requests']} ({summary['throttled']} throttled), "
+              f"{summary['requests_per_second']:.1f} req/s")
+        print(f"Bytes:      {summary['bytes'] / 1e6:.1f} MB, {summary['bytes_per_second'] / 1e6:.1f} MB/s")
+    _lat = summary['latency_seconds']
+    if _lat:
+        print("Latency:    " + ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in _lat.items()))
+    if summary['metadata_seconds']:
+        print("Metadata:   " + ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in summary['metadata_seconds'].items()))
+    for _error in summary['errors']:
+        print(f"Error:      {_error}")
+
+
+def main(argv: list[str] = None):
+    from prefetch import parse_commodities, parse_periods
+
+    parser = argparse.ArgumentParser(
+        prog="main.py load-test",
+        description="Drive the downloaders through a local Comtrade API stand-in and report throughput"
+    )
+    parser.add_argument("commodities", help="HS codes, names or ranges, e.g. 2201-2209,wine")
+    parser.add_argument("years", help="Years or ranges, e.g. 2015-2023")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent downloads")
+    parser.add_argument("--metadata", action="store_true", help="Also time the MetaData downloads")
+    parser.add_argument("--url", default=None, help="Use the stand-in at this URL instead of starting one")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    add_standin_arguments(parser)
+    args = parser.parse_args(argv)
+
+    standin = None
+    base_url = args.url
+    if base_url is None:
+        standin = ComtradeStandIn(
+            recordings_dir=args.recordings,
+            latency=args.latency,
+            jitter=args.jitter,
+            rate=args.rate,
+            records=args.records
+        )
+        base_url = standin.start()
+
+    try:
+        summary = run_load_test(
+            base_url,
+            parse_commodities(args.commodities),
+            parse_periods(args.years),
+            workers=args.workers,
+            metadata=args.metadata
+        )
+    finally:
+        if standin is not None:
+            standin.stop()
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_report(summary)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
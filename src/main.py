@@ -1,10 +1,66 @@
+import sys
 import argparse
-from create_viz import create_trade_visualization
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Create trade visualization")
+    if len(sys.argv) > 1 and sys.argv[1] == "prefetch":
+        from prefetch import main as prefetch_main
+        sys.exit(prefetch_main(sys.argv[2:]))
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "render-batch":
+        from batch_render import main as render_batch_main
+        sys.exit(render_batch_main(sys.argv[2:]))
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        from map_server import main as serve_main
+        sys.exit(serve_main(sys.argv[2:]))
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "standin":
+        from api_standin import main as standin_main
+        sys.exit(standin_main(sys.argv[2:]))
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "load-test":
+        from load_test import main as load_test_main
+        sys.exit(load_test_main(sys.argv[2:]))
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        from flow_store import main as query_main
+        sys.exit(query_main(sys.argv[2:]))
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "lod-report":
+        from flow_lod import main as lod_report_main
+        sys.exit(lod_report_main(sys.argv[2:]))
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "search":
+        search_parser = argparse.ArgumentParser(prog="main.py search", description="Search HS commodity codes")
+        search_parser.add_argument("query", nargs="+", help="Words or the start of an HS code, e.g. sparkling wine")
+        search_parser.add_argument("-n", type=int, default=10, help="Number of results")
+        search_args = search_parser.parse_args(sys.argv[2:])
+        
+        from codes.get_codes import codes
+        for _code, _desc, _ in codes.commodity_index.search(" ".join(search_args.query), limit=search_args.n):
+            print(f"{_code:<8} {_desc}")
+        sys.exit(0)
+    
+    parser = argparse.ArgumentParser(
+        description="Create trade visualization",
+        epilog="Run 'main.py search <words>' to look up HS codes, "
+               "'main.py prefetch --help' to download data for many commodities and years, "
+               "'main.py render-batch --help' to render many maps in parallel, "
+               "'main.py serve --help' to serve maps over HTTP, "
+               "or 'main.py lod-report --help' to compare flow level-of-detail policies"
+    )
     parser.add_argument("commodity", help="Commodity to visualize (e.g., wine) or hscode (e.g. 2204)")
     parser.add_argument("year", type=int, help="Year to visualize")
+    # Kept in step with create_viz.FLOW_MODES, which is not imported here so that
+    # --help does not load the data and plotting libraries
+    parser.add_argument("--flow-mode", choices=("grouped", "pairs", "client"), default="grouped",
+                        help="Draw flows grouped per country (fast) or as one trace per pair")
+    parser.add_argument("--lod", default=None,
+                        help="Only draw each country's main flows: top:N partners, share:0.95 of its "
+                             "value, or min:VALUE in US$; the rest are summed up in the hover text")
     
     args = parser.parse_args()
-    create_trade_visualization(args.commodity, args.year)
\ No newline at end of file
+    
+    from create_viz import create_trade_visualization
+    
+    create_trade_visualization(args.commodity, args.year, flow_mode=args.flow_mode, lod=args.lod)
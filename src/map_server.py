@@ -0,0 +1,302 @@
+"""
+Local HTTP server that renders maps on demand.
+
+    python3 src/main.py serve --port 8050
+
+GET /map/{commodity}/{year}     the map page, e.g. /map/wine/2023 or /map/2204/2023
+                                (?flow_mode=pairs to override the server's flow mode)
+GET /plotly-{version}.min.js    the plotly.js bundle every page loads
+GET /stats                      render and data cache statistics as JSON
+
+Data comes from data_cache, and so from the DataGetter file cache. Rendered
+pages are kept in a bounded in-memory cache and served with an ETag, so a
+client sending If-None-Match gets 304 Not Modified. The gzip and identity
+bodies of a page are different representations and have different ETags. Concurrent requests for
+a page that is being rendered wait for that one render instead of starting
+their own.
+"""
+
+
+import re
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+import threading
+from typing import Callable
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from byte_lru import ByteLRU
+from create_viz import FLOW_MODES
+
+_MAP_PATH = re.compile(r"^/map/([^/]+)/(\d{4})/?$")
+
+
+class RenderedMap:
+    """A rendered page and a gzip-compressed copy, each with its own ETag"""
+    def __init__(self, html: bytes):
+        self.html = html
+        self.gzipped = gzip.compress(html, compresslevel=6)
+        _hash = hashlib.sha1(html).hexdigest()[:20]
+        self.etag = f'"{_hash}"'
+        self.gzip_etag = f'"{_hash}-gz"'
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.html) + len(self.gzipped)
+
+
+class _Build:
+    """A render in progress, shared by every request waiting for it"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: RenderedMap | None = None
+        self.error: BaseException | None = None
+
+
+class RenderCache:
+    """
+    Least recently used cache of rendered pages, bounded by their total size.
+    Renders of the same key are coalesced: while one is running, other
+    requests for that key wait for its result. Failed renders are not cached.
+    """
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = ByteLRU(max_bytes, lambda page: page.nbytes)
+        self._building: dict[tuple, _Build] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self) -> int:
+        return self._entries.max_bytes
+
+    @property
+    def nbytes(self) -> int:
+        return self._entries.nbytes
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes
+        }
+
+    def get(self, key: tuple, render: Callable[[], bytes]) -> RenderedMap:
+        """
+        Returns the cached page for the key, rendering it with render() if needed.
+        """
+        with self._lock:
+            page = self._entries.get(key)
+            if page is not None:
+                self.hits += 1
+                return page
+            build = self._building.get(key)
+            owner = build is None
+            if owner:
+                build = self._building[key] = _Build()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            build.done.wait()
+            if build.error is not None:
+                raise build.error
+            return build.result
+
+        try:
+            build.result = RenderedMap(render())
+        except BaseException as e:
+            build.error = e
+            raise
+        else:
+            with self._lock:
+                self._entries.put(key, build.result)
+            return build.result
+        finally:
+            with self._lock:
+                del self._building[key]
+            build.done.set()
+
+
+class MapService:
+    def __init__(self, flow_mode: str = "grouped", max_bytes: int = 256 * 2**20):
+        """
+        Args:
+            flow_mode: Default flow mode, see create_viz.ComtradeExportMap
+            max_bytes: Size limit of the rendered page cache
+        """
+        import plotly
+        from plotly.offline import get_plotlyjs
+
+        if flow_mode not in FLOW_MODES:
+            raise ValueError(f"Invalid flow mode: {flow_mode}. Expected one of {FLOW_MODES}.")
+        self.flow_mode = flow_mode
+        self.renders = RenderCache(max_bytes)
+        self.plotlyjs_path = f"/plotly-{plotly.__version__}.min.js"
+        self.plotlyjs = RenderedMap(get_plotlyjs().encode('utf-8'))
+
+    def render(self, commodity_code: str, period: int, flow_mode: str) -> bytes:
+        import io
+        from get_data import data_cache
+        from create_viz import ComtradeExportMap
+
+        data = data_cache.get(commodity_code, period)
+        trade_map = ComtradeExportMap(data, flow_mode=flow_mode)
+        _out = io.StringIO()
+        trade_map.write_html(_out, include_plotlyjs=self.plotlyjs_path)
+        return _out.getvalue().encode('utf-8')
+
+    @staticmethod
+    def parse_commodity(commodity: str) -> str:
+        """
+        The HS code of a commodity given as a code or description in a URL.
+
+        Raises:
+            ValueError: If the commodity is not known
+        """
+        from load_data import DataGetter
+        return DataGetter.parse_commodity_code(int(commodity) if commodity.isdigit() else commodity)
+
+    def get_map(self, commodity: str, period: int, flow_mode: str | None = None) -> RenderedMap:
+        """
+        Raises:
+            ValueError: If the commodity or flow mode is not valid. Errors while
+                loading the data or rendering are raised as they are
+        """
+        flow_mode = self.flow_mode if flow_mode is None else flow_mode
+        if flow_mode not in FLOW_MODES:
+            raise ValueError(f"Invalid flow mode: {flow_mode}. Expected one of {FLOW_MODES}.")
+        code = self.parse_commodity(commodity)
+        key = (code, period, flow_mode)
+        return self.renders.get(key, lambda: self.render(code, period, flow_mode))
+
+    def stats(self) -> dict:
+        from get_data import data_cache
+        return {'renders': self.renders.stats(), 'data': data_cache.stats()}
+
+
+class MapRequestHandler(BaseHTTPRequestHandler):
+    service: MapService = None
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def _handle(self, send_body: bool):
+        _url = urlsplit(self.path)
+        _query = parse_qs(_url.query)
+
+        if _url.path == self.service.plotlyjs_path:
+            self._send_page(self.service.plotlyjs, "application/javascript", send_body,
+                            cache_control="public, max-age=31536000, immutable")
+            return
+
+        if _url.path == "/stats":
+            self._send_text(200, json.dumps(self.service.stats(), indent=2), "application/json", send_body)
+            return
+
+        _match = _MAP_PATH.match(_url.path)
+        if not _match:
+            self._send_text(404, "Not found. Expected /map/{commodity}/{year}.\n", "text/plain", send_body)
+            return
+
+        commodity, period = unquote(_match.group(1)), int(_match.group(2))
+        flow_mode = _query.get('flow_mode', [None])[0]
+        if flow_mode is not None and flow_mode not in FLOW_MODES:
+            self._send_text(400, f"Invalid flow_mode: {flow_mode}. Expected one of {', '.join(FLOW_MODES)}.\n",
+                            "text/plain", send_body)
+            return
+        try:
+            code = self.service.parse_commodity(commodity)
+        except ValueError as e:
+            self._send_text(404, f"{e}\n", "text/plain", send_body)
+            return
+        # Anything else, such as a missing API key or a failed download, is a server error
+        try:
+            page = self.service.get_map(code, period, flow_mode)
+        except Exception as e:
+            self.log_error("Rendering %s %s failed: %s: %s", commodity, period, type(e).__name__, e)
+            self._send_text(500, f"Could not render the map: {type(e).__name__}: {e}\n", "text/plain", send_body)
+            return
+
+        self._send_page(page, "text/html; charset=utf-8", send_body)
+
+    def _not_modified(self, etag: str) -> bool:
+        _tags = self.headers.get("If-None-Match")
+        if not _tags:
+            return False
+        _tags = [t.strip().removeprefix("W/") for t in _tags.split(",")]
+        return "*" in _tags or etag in _tags
+
+    def _send_page(self, page: RenderedMap, content_type: str, send_body: bool, cache_control: str = "no-cache"):
+        _gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        etag = page.gzip_etag if _gzip else page.etag
+        if self._not_modified(etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+
+        body = page.gzipped if _gzip else page.html
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+        if _gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_text(self, status: int, text: str, content_type: str, send_body: bool):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8050, service: MapService = None) -> ThreadingHTTPServer:
+    """Creates the server; call serve_forever() on it to start serving"""
+    handler = type("Handler", (MapRequestHandler,), {'service': service or MapService()})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(prog="main.py serve", description="Serve maps rendered on demand over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--flow-mode", choices=FLOW_MODES, default="grouped")
+    parser.add_argument("--cache-mb", type=int, default=256, help="Size limit of the rendered page cache in MB")
+
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, MapService(args.flow_mode, args.cache_mb * 2**20))
+    print(f"Serving maps on http://{args.host}:{server.server_port}/map/{{commodity}}/{{year}}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Multi-year panel of one commodity, stored as memory-mapped columns.
+
+A panel is one long table of (period, exporter, partner, value, quantity)
+rows for every cached period of a commodity. It lives next to the cache files:
+
+    hs2204/panel/period.bin      int16
+    hs2204/panel/exporter.bin    int16 codes of codes.country_dtype, -1 if unknown
+    hs2204/panel/partner.bin     int16
+    hs2204/panel/value.bin       float64
+    hs2204/panel/quantity.bin    float64
+    hs2204/panel/index.json      rows, the row range of each period, and the countries
+
+Each period is appended to the column files when it is cached, and the index
+is replaced last, so a panel interrupted mid-append still opens with the
+periods it had. Appends take a file lock, so several processes can cache
+periods of the same commodity at once. Opening maps the files read-only instead of reading them,
+which is near-instant and lets processes that open the same panel share
+its pages.
+"""
+
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from codes.get_codes import codes
+from file_lock import FileLock, atomic_open
+
+
+PANEL_DIR = "panel"
+INDEX_FILE = "index.json"
+
+COLUMNS = {
+    'period': np.int16,
+    'exporter': np.int16,
+    'partner': np.int16,
+    'value': np.float64,
+    'quantity': np.float64,
+}
+
+
+class Panel:
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: The panel directory, see DataGetter.panel()
+        """
+        self.directory = directory
+        self._index = None
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, INDEX_FILE))
+
+    def _column_file(self, column: str) -> str:
+        return os.path.join(self.directory, f"{column}.bin")
+
+    @property
+    def index(self) -> dict:
+        """{'rows': int, 'periods': {period: [start, stop]}, 'countries': [...]}"""
+        if self._index is None:
+            _fp = os.path.join(self.directory, INDEX_FILE)
+            if os.path.exists(_fp):
+                with open(_fp, 'r') as _f:
+                    self._index = json.load(_f)
+                self._index['periods'] = {int(p): r for p, r in self._index['periods'].items()}
+            else:
+                self._index = {'rows': 0, 'periods': {}, 'countries': list(codes.country_dtype.categories)}
+        return self._index
+
+    @property
+    def periods(self) -> list[int]:
+        return sorted(self.index['periods'])
+
+    def _write_index(self):
+        with atomic_open(os.path.join(self.directory, INDEX_FILE), 'w') as _f:
+            json.dump(self.index, _f)
+    
+    def _lock(self) -> FileLock:
+        return FileLock(os.path.join(self.directory, INDEX_FILE))
+
+    def clear(self):
+        """Removes all periods"""
+        with self._lock():
+            for column in COLUMNS:
+                if os.path.exists(self._column_file(column)):
+                    os.remove(self._column_file(column))
+            self._index = {'rows': 0, 'periods': {}, 'countries': list(codes.country_dtype.categories)}
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_index()
+
+    def append(self, period: int, df: pd.DataFrame):
+        """
+        Appends one period. A period that is already in the panel is not appended
+        again; to replace it, clear() the panel and append every period.
+
+        Args:
+            period: Year
+            df: Tidied table with 'exporter', 'partner', 'quantity' and 'value'
+        """
+        period = int(period)
+        with self._lock():
+            # Another process may have appended since the index was read
+            self._index = None
+            self._append(period, df)
+
+    def _append(self, period: int, df: pd.DataFrame):
+        if period in self.index['periods']:
+            return
+        if self.index['countries'] != list(codes.country_dtype.categories):
+            raise ValueError(f"The panel in {self.directory} uses another country list; clear() and rebuild it.")
+        os.makedirs(self.directory, exist_ok=True)
+
+        n = len(df)
+        _columns = {
+            'period': np.full(n, period, dtype=COLUMNS['period']),
+            'exporter': df['exporter'].astype(codes.country_dtype).cat.codes.to_numpy().astype(COLUMNS['exporter']),
+            'partner': df['partner'].astype(codes.country_dtype).cat.codes.to_numpy().astype(COLUMNS['partner']),
+            'value': df['value'].to_numpy(dtype=COLUMNS['value']),
+            'quantity': df['quantity'].to_numpy(dtype=COLUMNS['quantity']),
+        }
+        _rows = self.index['rows']
+        for column, values in _columns.items():
+            with open(self._column_file(column), 'ab') as _f:
+                # Drop anything written after the last complete append
+                _f.truncate(_rows * np.dtype(COLUMNS[column]).itemsize)
+                _f.write(values.tobytes())
+
+        self.index['periods'][period] = [_rows, _rows + n]
+        self.index['rows'] = _rows + n
+        self._write_index()
+
+    def columns(self) -> dict[str, np.ndarray]:
+        """Read-only memory maps of the columns, as far as the index covers them"""
+        n = self.index['rows']
+        if n == 0:
+            return {column: np.empty(0, dtype=dtype) for column, dtype in COLUMNS.items()}
+        return {
+            column: np.memmap(self._column_file(column), dtype=dtype, mode='r', shape=(n,))
+            for column, dtype in COLUMNS.items()
+        }
+
+    def open(self, periods: list[int] | None = None) -> pd.DataFrame:
+        """
+        The panel as a DataFrame over the memory-mapped columns.
+
+        Args:
+            periods: Years to include, None for all. Only periods whose rows are
+                contiguous in the files come without a copy; other selections are copied.
+
+        Returns:
+            pd.DataFrame: 'period', 'exporter', 'partner', 'value', 'quantity', with
+                exporter and partner as categories of codes.country_dtype.
+        """
+        _columns = self.columns()
+        if periods is not None:
+            _ranges = sorted(self.index['periods'][int(p)] for p in periods if int(p) in self.index['periods'])
+            if not _ranges:
+                _columns = {column: values[:0] for column, values in _columns.items()}
+            elif all(a[1] == b[0] for a, b in zip(_ranges, _ranges[1:])):
+                _slice = slice(_ranges[0][0], _ranges[-1][1])
+                _columns = {column: values[_slice] for column, values in _columns.items()}
+            else:
+                _rows = np.concatenate([np.arange(start, stop) for start, stop in _ranges])
+                _columns = {column: values[_rows] for column, values in _columns.items()}
+
+        return pd.DataFrame({
+            'period': _columns['period'],
+            'exporter': pd.Categorical.from_codes(_columns['exporter'], dtype=codes.country_dtype),
+            'partner': pd.Categorical.from_codes(_columns['partner'], dtype=codes.country_dtype),
+            'value': _columns['value'],
+            'quantity': _columns['quantity'],
+        }, copy=False)
@@ -3,20 +3,17 @@ import inspect
 import json
 
 
+# Directories are created when something is first written to them
 comtrade_data_path = os.path.join(
         os.path.expanduser("~"),
         "Downloads",
         "comtrade"
     )
     
-    
-if not os.path.exists(comtrade_data_path):
-    os.makedirs(comtrade_data_path)
-    
 
 plots_dir = os.path.join(comtrade_data_path, "plots")
-if not os.path.exists(plots_dir):
-    os.makedirs(plots_dir)
+
+flow_store_path = os.path.join(comtrade_data_path, "flows.sqlite")
     
     
 def dir_path() -> str:
@@ -32,6 +29,9 @@ def get_secrets() -> dict:
         ".secrets.json"
     )
     
+    if not os.path.exists(secrets_path):
+        return {}
+    
     with open(secrets_path, "r") as _f:
         s = json.load(_f)
     
@@ -0,0 +1,186 @@
+"""
+Downloads the uncached data for many commodities and years concurrently,
+within the API's per-second and daily request quotas.
+
+    python3 src/main.py prefetch 2201-2209,wine 2015-2023 --workers 4
+"""
+
+
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from load_data import DataGetter
+from rate_limit import RateLimiter, QuotaExceeded
+from codes.get_codes import codes
+
+
+def parse_commodities(arg: str) -> list[str]:
+    """
+    Parses a comma separated list of HS codes, commodity descriptions
+    and ranges of HS codes such as "2201-2209". A range includes every
+    known code of the same length between its ends.
+    """
+    commodity_codes = []
+    for _item in arg.split(","):
+        _item = _item.strip()
+        if not _item:
+            continue
+        _ends = _item.split("-")
+        if len(_ends) == 2 and all(e.isdigit() for e in _ends):
+            _start, _stop = _ends
+            if len(_start) != len(_stop):
+                raise ValueError(f"Invalid commodity range: {_item}.")
+            commodity_codes += sorted(
+                c for c in codes.hs_to_desc
+                if len(c) == len(_start) and c.isdigit() and _start <= c <= _stop
+            )
+        else:
+            commodity_codes.append(DataGetter.parse_commodity_code(_item))
+    return list(dict.fromkeys(commodity_codes))
+
+
+def parse_periods(arg: str) -> list[int]:
+    """Parses a comma separated list of years and ranges of years such as "2015-2023"."""
+    periods = []
+    for _item in arg.split(","):
+        _item = _item.strip()
+        if not _item:
+            continue
+        if "-" in _item:
+            _start, _stop = (int(x) for x in _item.split("-"))
+            periods += list(range(_start, _stop + 1))
+        else:
+            periods.append(int(_item))
+    return list(dict.fromkeys(periods))
+
+
+def prefetch(data_getter: DataGetter,
+             commodity_codes: list[str],
+             periods: list[int],
+             workers: int = 4,
+             rate_limiter: RateLimiter = None) -> dict:
+    """
+    Downloads every uncached (commodity, period) cell. Cells are packed into
+    batched requests (see DataGetter.missing_batches) that run on a thread pool.
+    Each batch holds the locks of its cells (see DataGetter.download_batch), so
+    cells cached meanwhile by another worker or process are not downloaded again.
+
+    Args:
+        data_getter: DataGetter whose cache is filled
+        commodity_codes: Parsed HS commodity codes
+        periods: Years
+        workers: Number of concurrent requests
+        rate_limiter: Limits the requests of data_getter's HTTP client while prefetching
+
+    Returns:
+        dict: Summary of the run
+    """
+    _cells = len(commodity_codes) * len(periods)
+    batches = data_getter.missing_batches(commodity_codes, periods)
+    _missing = sum(len(c) * len(p) for c, p in batches)
+
+    _previous_limiter = data_getter.http_client.rate_limiter
+    if rate_limiter is not None:
+        data_getter.http_client.rate_limiter = rate_limiter
+
+    # Set once the daily quota is used up. Every later request would fail the
+    # same way, so batches that have not started by then are skipped
+    quota_exceeded = threading.Event()
+
+    def _download(_codes, _periods):
+        if quota_exceeded.is_set():
+            return None
+        return data_getter.download_batch(_codes, _periods)
+
+    downloaded = 0
+    failed = []
+    skipped = []
+    t0 = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_download, _codes, _periods): (_codes, _periods)
+                for _codes, _periods in batches
+            }
+            for future in as_completed(futures):
+                _codes, _periods = futures[future]
+                try:
+                    written = future.result()
+                except QuotaExceeded as e:
+                    failed.append((_codes, _periods, str(e)))
+                    if not quota_exceeded.is_set():
+                        quota_exceeded.set()
+                        print(f"{e} Skipping the remaining requests.")
+                except Exception as e:
+                    failed.append((_codes, _periods, str(e)))
+                    print(f"Failed to download {_codes} for {_periods}: {e}")
+                else:
+                    if written is None:
+                        skipped.append((_codes, _periods))
+                    else:
+                        downloaded += len(written)
+    finally:
+        data_getter.http_client.rate_limiter = _previous_limiter
+    elapsed = time.perf_counter() - t0
+
+    return {
+        'cells': _cells,
+        'cached': _cells - _missing,
+        'requests': len(batches),
+        'downloaded': downloaded,
+        'empty': _missing - downloaded - sum(len(c) * len(p) for c, p, _ in failed)
+                 - sum(len(c) * len(p) for c, p in skipped),
+        'failed_requests': len(failed),
+        'skipped_requests': len(skipped),
+        'elapsed': elapsed,
+        'cells_per_second': downloaded / elapsed if elapsed > 0 else 0.0,
+        'quota_used': rate_limiter.used if rate_limiter is not None else None,
+        'quota_remaining': rate_limiter.remaining if rate_limiter is not None else None,
+    }
+
+
+def print_summary(summary: dict):
+    print(f"{summary['cells']} cells: {summary['cached']} already cached, "
+          f"{summary['downloaded']} downloaded in {summary['requests']} requests, "
+          f"{summary['empty']} without data")
+    if summary['failed_requests']:
+        print(f"{summary['failed_requests']} requests failed")
+    if summary['skipped_requests']:
+        print(f"{summary['skipped_requests']} requests skipped once the daily quota was used up")
+    print(f"Took {summary['elapsed']:.1f}s ({summary['cells_per_second']:.2f} cells/s)")
+    if summary['quota_remaining'] is not None:
+        print(f"Quota: {summary['quota_used']} requests used, {summary['quota_remaining']} remaining today")
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="main.py prefetch",
+        description="Download uncached Comtrade data for many commodities and years"
+    )
+    parser.add_argument("commodities", help="HS codes, names or ranges, e.g. 2201-2209,wine")
+    parser.add_argument("years", help="Years or ranges, e.g. 2015-2023")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests")
+    parser.add_argument("--rate", type=float, default=1.0, help="Requests per second allowed by the subscription")
+    parser.add_argument("--burst", type=int, default=1, help="Requests that may be sent back to back")
+    parser.add_argument("--daily-quota", type=int, default=500, help="Requests remaining today (0 for no limit)")
+
+    args = parser.parse_args(argv)
+
+    from get_data import data_getter
+
+    limiter = RateLimiter(
+        per_second=args.rate,
+        burst=args.burst,
+        daily_quota=args.daily_quota or None
+    )
+    summary = prefetch(
+        data_getter,
+        parse_commodities(args.commodities),
+        parse_periods(args.years),
+        workers=args.workers,
+        rate_limiter=limiter
+    )
+    print_summary(summary)
+    return 1 if summary['failed_requests'] or summary['skipped_requests'] else 0
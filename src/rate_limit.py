@@ -0,0 +1,65 @@
+"""
+Token-bucket rate limiting for API requests, shared between threads.
+"""
+
+
+import time
+import threading
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class RateLimiter:
+    def __init__(self, per_second: float = 1.0, burst: int = 1, daily_quota: int | None = None):
+        """
+        Args:
+            per_second: Sustained request rate
+            burst: Requests that may be sent back to back before the rate applies
+            daily_quota: Requests allowed in total, or None for no limit
+        """
+        if per_second <= 0:
+            raise ValueError(f"per_second must be positive, got {per_second}.")
+        self.per_second = per_second
+        self.burst = max(1, burst)
+        self.daily_quota = daily_quota
+
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    @property
+    def remaining(self) -> int | None:
+        if self.daily_quota is None:
+            return None
+        return max(0, self.daily_quota - self._used)
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent and counts it against the daily quota.
+
+        Raises:
+            QuotaExceeded: If the daily quota has been used up.
+        """
+        while True:
+            with self._lock:
+                if self.daily_quota is not None and self._used >= self.daily_quota:
+                    raise QuotaExceeded(f"Daily quota of {self.daily_quota} requests used up.")
+
+                _now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (_now - self._last) * self.per_second)
+                self._last = _now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self._used += 1
+                    return
+                _wait = (1 - self._tokens) / self.per_second
+
+            time.sleep(_wait)
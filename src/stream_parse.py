@@ -0,0 +1,162 @@
+"""
+Incremental parsing of Comtrade API responses.
+
+A response body looks like {"elapsedTime": ..., "count": N, "data": [{...}, ...], "error": ...}.
+read_columns() reads it chunk by chunk and keeps only the requested fields of
+each record in typed arrays, so the raw bytes, the decoded text and the full
+list of record dicts are never in memory at once.
+"""
+
+
+import re
+import json
+import codecs
+from array import array
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+
+_WHITESPACE = re.compile(r"\s*")
+
+# How many characters of consumed input may pile up before the buffer is trimmed
+_TRIM_AT = 1 << 16
+
+
+class _Reader:
+    """Text buffer over an iterable of byte chunks"""
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self) -> bool:
+        """Appends the next chunk to the buffer; False once the input is exhausted"""
+        if self.eof:
+            return False
+        if self.pos > _TRIM_AT:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for _chunk in self._chunks:
+            _text = self._decoder.decode(_chunk)
+            if _text:
+                self.buf += _text
+                return True
+        self.buf += self._decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """Next non-whitespace character, or "" at the end of the input"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of the response.")
+        self.pos += 1
+
+    def value(self):
+        """
+        Decodes the next JSON value. A value is only accepted once the character
+        after it is in the buffer, so numbers split across chunks are not cut short.
+        """
+        self.peek()
+        while True:
+            try:
+                _value, _end = self._json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.more():
+                    raise
+                continue
+            if _end < len(self.buf) or self.eof or not self.more():
+                self.pos = _end
+                return _value
+
+
+def iter_records(chunks: Iterable[bytes], key: str = "data") -> Iterator[dict]:
+    """
+    Yields the items of the array stored under a top-level key of a JSON object,
+    one at a time.
+    """
+    reader = _Reader(chunks)
+    reader.expect("{")
+    while reader.peek() != "}":
+        if reader.peek() == "":
+            raise ValueError("Unexpected end of the response.")
+        _key = reader.value()
+        reader.expect(":")
+        if _key != key:
+            reader.value()
+        else:
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.peek() == ",":
+                        reader.pos += 1
+                        continue
+                    reader.expect("]")
+                    break
+        if reader.peek() == ",":
+            reader.pos += 1
+
+
+def read_columns(chunks: Iterable[bytes], fields: dict[str, str], key: str = "data") -> pd.DataFrame:
+    """
+    Reads the records of a response into a DataFrame with only the given fields.
+
+    Args:
+        chunks: The response body, in chunks
+        fields: Field name -> "int", "float" or "category". Missing or null
+            floats become NaN, missing ints -1 and missing categories NaN.
+        key: Top-level key holding the records
+
+    Returns:
+        pd.DataFrame: One column per field.
+    """
+    _arrays = {}
+    _categories = {}
+    for name, kind in fields.items():
+        if kind == "int":
+            _arrays[name] = array('q')
+        elif kind == "float":
+            _arrays[name] = array('d')
+        elif kind == "category":
+            _arrays[name] = array('q')
+            _categories[name] = {}
+        else:
+            raise ValueError(f"Invalid field type for {name}: {kind}.")
+
+    _nan = float('nan')
+    for record in iter_records(chunks, key):
+        for name, kind in fields.items():
+            _value = record.get(name)
+            if kind == "int":
+                _arrays[name].append(-1 if _value is None else int(_value))
+            elif kind == "float":
+                _arrays[name].append(_nan if _value is None else float(_value))
+            elif _value is None:
+                _arrays[name].append(-1)
+            else:
+                _lookup = _categories[name]
+                _arrays[name].append(_lookup.setdefault(str(_value), len(_lookup)))
+
+    columns = {}
+    for name, kind in fields.items():
+        _values = np.array(_arrays[name], dtype=np.float64 if kind == "float" else np.int64)
+        if kind == "category":
+            columns[name] = pd.Categorical.from_codes(_values, categories=list(_categories[name]))
+        else:
+            columns[name] = _values
+    return pd.DataFrame(columns)
@@ -0,0 +1,214 @@
+"""
+Trade data as a country × country matrix.
+
+Rows are exporters and columns are partners, both indexed by the codes of the
+shared country dtype (codes.country_dtype, built from codes.m49_to_iso), so
+a country has the same row and column in every matrix. One extra last
+row/column holds flows with an unknown country.
+
+The matrix is either dense (two n × n float arrays, ~1 MB for the ~250
+countries) or CSR (indptr/indices/data arrays over the non-empty pairs).
+
+matrix.get("FRA", "DEU"):   (value, quantity) of one flow, O(1) when dense
+matrix.row_sums():          total exports per country
+matrix.col_sums():          total imports per country
+matrix.top_partners(k):     the k largest partners of every country
+"""
+
+
+import numpy as np
+import pandas as pd
+
+
+LAYOUTS = ("dense", "csr")
+
+
+class TradeMatrix:
+    def __init__(self, df: pd.DataFrame, layout: str = "dense"):
+        """
+        Args:
+            df: Edge table with 'exporter', 'partner', 'value' and 'quantity'.
+                exporter and partner must share one categorical dtype
+            layout: "dense" or "csr"
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f"Invalid matrix layout: {layout}. Expected one of {LAYOUTS}.")
+        dtype = df['exporter'].dtype
+        if not isinstance(dtype, pd.CategoricalDtype) or df['partner'].dtype != dtype:
+            raise ValueError("exporter and partner must share one categorical dtype.")
+
+        self.layout = layout
+        self.dtype = dtype
+        self.n = len(dtype.categories) + 1
+        self.unknown = self.n - 1
+        self._positions = {c: i for i, c in enumerate(dtype.categories)}
+
+        _rows = df['exporter'].cat.codes.to_numpy().astype(np.int64)
+        _cols = df['partner'].cat.codes.to_numpy().astype(np.int64)
+        _rows[_rows < 0] = self.unknown
+        _cols[_cols < 0] = self.unknown
+
+        # Sum duplicate pairs. A pair's value or quantity is NaN only if it
+        # is missing in every row of the pair, as with pandas' sum(min_count=1)
+        keys, _inverse = np.unique(_rows * self.n + _cols, return_inverse=True)
+        values = self._sum_by(_inverse, df['value'].to_numpy(dtype=float), len(keys))
+        quantities = self._sum_by(_inverse, df['quantity'].to_numpy(dtype=float), len(keys))
+        rows, cols = np.divmod(keys, self.n)
+
+        if layout == "dense":
+            self.value = np.full((self.n, self.n), np.nan)
+            self.quantity = np.full((self.n, self.n), np.nan)
+            self.present = np.zeros((self.n, self.n), dtype=bool)
+            self.value[rows, cols] = values
+            self.quantity[rows, cols] = quantities
+            self.present[rows, cols] = True
+        else:
+            # keys are sorted, so the pairs are already in row-major order
+            self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=self.n))])
+            self.indices = cols
+            self.value = values
+            self.quantity = quantities
+
+    @staticmethod
+    def _sum_by(groups: np.ndarray, x: np.ndarray, n: int) -> np.ndarray:
+        _sums = np.bincount(groups, weights=np.nan_to_num(x), minlength=n)
+        _counts = np.bincount(groups, weights=~np.isnan(x), minlength=n)
+        return np.where(_counts > 0, _sums, np.nan)
+
+    @property
+    def nbytes(self) -> int:
+        _arrays = [self.value, self.quantity]
+        _arrays += [self.present] if self.layout == "dense" else [self.indptr, self.indices]
+        return sum(a.nbytes for a in _arrays)
+
+    def position(self, country: str | None) -> int:
+        """Row/column of an ISO3 code; None or an unknown code gives the unknown row"""
+        return self._positions.get(country, self.unknown)
+
+    def coo(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns:
+            (rows, cols, values, quantities) of every non-empty pair, in row-major order
+        """
+        if self.layout == "dense":
+            rows, cols = np.nonzero(self.present)
+            return rows, cols, self.value[rows, cols], self.quantity[rows, cols]
+        rows = np.repeat(np.arange(self.n), np.diff(self.indptr))
+        return rows, self.indices, self.value, self.quantity
+
+    def get(self, exporter: str, partner: str) -> tuple[float, float]:
+        """
+        Returns:
+            (value, quantity) of the flow from exporter to partner; (0, 0) if there is none
+        """
+        i, j = self.position(exporter), self.position(partner)
+        if self.layout == "dense":
+            if not self.present[i, j]:
+                return 0.0, 0.0
+            return float(self.value[i, j]), float(self.quantity[i, j])
+        _lo, _hi = self.indptr[i], self.indptr[i + 1]
+        k = _lo + np.searchsorted(self.indices[_lo:_hi], j)
+        if k == _hi or self.indices[k] != j:
+            return 0.0, 0.0
+        return float(self.value[k]), float(self.quantity[k])
+
+    def _sums(self, axis: int, kind: str) -> np.ndarray:
+        if self.layout == "dense":
+            return np.nansum(getattr(self, kind), axis=1 - axis)
+        rows, cols, values, quantities = self.coo()
+        _x = values if kind == "value" else quantities
+        return np.bincount(rows if axis == 0 else cols, weights=np.nan_to_num(_x), minlength=self.n)
+
+    def row_sums(self, kind: str = "value") -> np.ndarray:
+        """Total 'value' or 'quantity' exported by each row's country"""
+        return self._sums(0, kind)
+
+    def col_sums(self, kind: str = "value") -> np.ndarray:
+        """Total 'value' or 'quantity' imported by each column's country"""
+        return self._sums(1, kind)
+
+    def counts(self, axis: int = 0) -> np.ndarray:
+        """Number of partners of each row (axis=0) or column (axis=1)"""
+        if self.layout == "dense":
+            return self.present.sum(axis=1 - axis)
+        if axis == 0:
+            return np.diff(self.indptr)
+        return np.bincount(self.indices, minlength=self.n)
+
+    def top_partners(self, k: int, axis: int = 0) -> list[np.ndarray]:
+        """
+        The positions of the k largest partners by value of every row (axis=0)
+        or column (axis=1), largest first. Pairs with a missing value rank last.
+        """
+        if self.layout == "dense":
+            _values = self.value if axis == 0 else self.value.T
+            _present = self.present if axis == 0 else self.present.T
+            # Missing values rank below every value, absent pairs below those
+            _rank = np.where(_present, np.nan_to_num(_values, nan=-1.0), -np.inf)
+            _k = min(k, self.n)
+            _top = np.argpartition(-_rank, _k - 1, axis=1)[:, :_k]
+            _top_values = np.take_along_axis(_rank, _top, axis=1)
+            _order = np.argsort(-_top_values, axis=1, kind='stable')
+            _top = np.take_along_axis(_top, _order, axis=1)
+            _n = np.minimum(self.counts(axis), _k)
+            return [_top[i, :_n[i]] for i in range(self.n)]
+
+        rows, cols, values, _ = self.coo()
+        _own, _other = (rows, cols) if axis == 0 else (cols, rows)
+        _rank = np.nan_to_num(values, nan=-1.0)
+        # Group the pairs by country, keeping them in row-major order within it
+        _order = np.argsort(_own, kind='stable')
+        _bounds = np.concatenate([[0], np.cumsum(np.bincount(_own, minlength=self.n))])
+        top = []
+        for i in range(self.n):
+            _idx = _order[_bounds[i]:_bounds[i + 1]]
+            if len(_idx) > k:
+                _idx = _idx[np.argpartition(-_rank[_idx], k - 1)[:k]]
+            top.append(_other[_idx[np.argsort(-_rank[_idx], kind='stable')]])
+        return top
+
+    def aggregate(self, axis: int, top_k: int) -> pd.DataFrame:
+        """
+        Totals and top partners per country for exports (axis=0) or imports (axis=1),
+        in the format of ComtradeData.exports. Flows of unknown countries count
+        towards their partners' totals, and show as None among top partners.
+        """
+        _counts = self.counts(axis)[:self.unknown]
+        present = np.flatnonzero(_counts)
+        _sums = self.row_sums if axis == 0 else self.col_sums
+        _names = np.append(np.asarray(self.dtype.categories, dtype=object), None)
+        _top = self.top_partners(top_k, axis)
+
+        aggregate = pd.DataFrame({
+            'country': pd.Categorical.from_codes(present, dtype=self.dtype),
+            'value': _sums("value")[present],
+            'quantity': _sums("quantity")[present],
+            'top_partners': [_names[_top[i]].tolist() for i in present]
+        })
+        aggregate['log_value'] = np.log10(aggregate['value'] + 1)  # +1 to handle zeros
+        return aggregate
+
+    def flows(self) -> pd.DataFrame:
+        """
+        Edge table of every non-empty pair with its log value and its share of
+        the largest log value of the same exporter ('export_share') and partner
+        ('import_share'), like ComtradeData.flows.
+        """
+        rows, cols, values, quantities = self.coo()
+        log_value = np.log10(np.where(np.nan_to_num(values) < 1, 1, np.nan_to_num(values)))
+        _codes = np.where(np.arange(self.n) == self.unknown, -1, np.arange(self.n))
+
+        flows = pd.DataFrame({
+            'quantity': quantities,
+            'value': values,
+            'exporter': pd.Categorical.from_codes(_codes[rows], dtype=self.dtype),
+            'partner': pd.Categorical.from_codes(_codes[cols], dtype=self.dtype),
+            'log_value': log_value
+        })
+        for share_col, _own in (('export_share', rows), ('import_share', cols)):
+            _max = np.zeros(self.n)
+            np.maximum.at(_max, _own, log_value)
+            # Like a groupby, which leaves out unknown countries, they get no share
+            _max = np.where(_own == self.unknown, 0, _max[_own])
+            flows[share_col] = np.divide(log_value, _max, out=np.zeros_like(log_value), where=_max > 0)
+        return flows